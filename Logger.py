@@ -2,30 +2,225 @@ import atexit
 import gzip
 import logging
 import logging.config
+import logging.handlers
 import os
 import pathlib
 import shutil
-import socket
 import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from logging.handlers import QueueListener
 from pathlib import Path
+from queue import Queue, Full
 from typing import Union
 
 import helper as h
 
 
+class TraceFilter(logging.Filter):
+    """
+    Add record.trace, e.g. 'pybot.py:97: main()', same format as helper.trace(). Uses the caller location logging
+    already found for the record, so nothing is inspected for records dropped by the level filter.
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not hasattr(record, 'trace'):
+            record.trace = f"{record.filename}:{record.lineno}: {record.funcName}()"
+        return True
+
+
+class ColorFormatter(logging.Formatter):
+    """
+    Color console lines by level. Only the formatted string is colored, the record is left untouched for other
+    handlers.
+    """
+    COLORS = ((50, '\x1b[31m'),  # red
+              (40, '\x1b[31m'),  # red
+              (30, '\x1b[33m'),  # yellow
+              (20, '\x1b[32m'),  # green
+              (10, '\x1b[35m'))  # pink
+    RESET = '\x1b[0m'  # normal
+
+    def format(self, record: logging.LogRecord) -> str:
+        msg = super().format(record)
+        for levelno, color in self.COLORS:
+            if record.levelno >= levelno:
+                return color + msg + self.RESET
+        return msg
+
+
+class BoundedQueueHandler(logging.handlers.QueueHandler):
+    def __init__(self, queue: Queue, overflow: str = "drop") -> None:
+        """
+        QueueHandler for a bounded queue
+        :param queue: queue.Queue with maxsize
+        :param overflow: 'drop' discards records while the queue is full and logs how many were lost,
+                         'block' waits for the listener to flush
+        """
+        assert overflow in ("drop", "block"), "overflow can only be 'drop' or 'block'"
+        super().__init__(queue)
+        self.overflow = overflow
+        self.dropped = 0
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        if self.overflow == "block":
+            self.queue.put(record)
+            return
+        try:
+            if self.dropped:
+                self.queue.put_nowait(self._dropped_record(record))
+                self.dropped = 0
+            self.queue.put_nowait(record)
+        except Full:
+            self.dropped += 1
+
+    def _dropped_record(self, record: logging.LogRecord) -> logging.LogRecord:
+        return logging.LogRecord(record.name, logging.WARNING, record.pathname, record.lineno,
+                                 f"Log queue full, dropped {self.dropped} records", None, None, record.funcName)
+
+
+class ArchivingFileHandler(logging.FileHandler):
+    def __init__(self,
+                 filename: str,
+                 archive_prefix: str,
+                 module: str = None,
+                 max_bytes: int = 0,
+                 interval: float = 0,
+                 backup_count: int = 0,
+                 max_archive_bytes: int = 0,
+                 mode: str = 'w',
+                 encoding: str = None) -> None:
+        """
+        File handler that rotates the log by size and/or age and gzips finished segments on a background thread.
+        Segments are named '{archive_prefix}.{index:03d}{suffixes}.gz', the remainder archived at exit keeps the
+        '{archive_prefix}{suffixes}.gz' name of Log._export.
+        :param filename: log file being written
+        :param archive_prefix: e.g. 'log/pybot-20210101-1200.00.user'
+        :param module: archive_prefix starts with '{module}-{date}', e.g. 'pybot'. Defaults to the log file name
+                       without its suffixes
+        :param max_bytes: rotate when the file would grow past this, 0 to disable
+        :param interval: rotate after this many seconds, 0 to disable
+        :param backup_count: max archives of this module kept in the archive folder, 0 for no limit
+        :param max_archive_bytes: max total size of those archives, 0 for no limit
+        """
+        super().__init__(filename, mode=mode, encoding=encoding)
+        self.archive_prefix = Path(archive_prefix)
+        self.suffixes = ''.join(Path(filename).suffixes)
+        self.module = Path(filename).name[:-len(self.suffixes) or None] if module is None else module
+        self.max_bytes = max_bytes
+        self.interval = interval
+        self.backup_count = backup_count
+        self.max_archive_bytes = max_archive_bytes
+        self.rollover_at = time.time() + interval
+        self.index = 0
+        self.compressor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="log-archive")
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            if self.should_rollover(record):
+                self.rollover()
+        except Exception:
+            self.handleError(record)
+            return
+        super().emit(record)
+
+    def should_rollover(self, record: logging.LogRecord) -> bool:
+        if self.stream is None:
+            return False
+        if self.interval and time.time() >= self.rollover_at:
+            return True
+        if self.max_bytes:
+            msg = f"{self.format(record)}{self.terminator}"
+            return self.stream.tell() + len(msg) >= self.max_bytes
+        return False
+
+    def rollover(self):
+        """
+        close the current segment, continue in a fresh file and compress the segment in the background
+        """
+        self.stream.close()
+        self.index += 1
+        segment = Path(f"{self.baseFilename}.{self.index:03d}")
+        os.replace(self.baseFilename, segment)
+        self.stream = self._open()
+        self.rollover_at = time.time() + self.interval
+        try:
+            self.compressor.submit(self._compress, segment, self.archive_path(self.index))
+        except RuntimeError:
+            # interpreter is shutting down or archive() already ran, no more background work
+            self._compress(segment, self.archive_path(self.index))
+
+    def archive_path(self, index: int = None) -> Path:
+        part = '' if index is None else f".{index:03d}"
+        return self.archive_prefix.with_name(f"{self.archive_prefix.name}{part}{self.suffixes}.gz")
+
+    def archive(self):
+        """
+        wait for pending segments, then compress what is left of the current file
+        """
+        self.compressor.shutdown(wait=True)
+        self.acquire()
+        try:
+            self.flush()
+            self._compress(Path(self.baseFilename), self.archive_path(), keep_src=True)
+        finally:
+            self.release()
+
+    def _compress(self, src: Path, dst: Path, keep_src: bool = False):
+        with open(src, 'rb') as f_in:
+            with gzip.open(dst, 'wb') as f_out:
+                shutil.copyfileobj(f_in, f_out)
+        if not keep_src:
+            src.unlink()
+        self._prune()
+
+    def _prune(self):
+        """
+        delete the oldest archives of this module past backup_count or max_archive_bytes
+        """
+        if not self.backup_count and not self.max_archive_bytes:
+            return
+        archives = sorted(self.archive_prefix.parent.glob(f"{self.module}-[0-9]*{self.suffixes}.gz"),
+                          key=lambda path: path.stat().st_mtime, reverse=True)
+        total = 0
+        for count, path in enumerate(archives, 1):
+            total += path.stat().st_size
+            if (self.backup_count and count > self.backup_count) or \
+                    (self.max_archive_bytes and total > self.max_archive_bytes and count > 1):
+                path.unlink()
+
+
 class Log:
     def __init__(self,
                  log_path: Union[str, pathlib.PurePath] = None,
                  desc=None,
                  con_lvl: str = "INFO",
                  log_lvl: str = "DEBUG",
-                 handler_gz: list = None) -> None:
+                 handler_gz: list = None,
+                 queued: bool = False,
+                 queue_size: int = 10000,
+                 overflow: str = "drop",
+                 max_bytes: int = 0,
+                 rotate_interval: float = 0,
+                 backup_count: int = 0,
+                 max_archive_bytes: int = 0,
+                 host_timeout: float = 2.0) -> None:
         """
         Specify Logging Parameters
         :param log_path: can only be str of Path object. Base path to be insert log files
         :param con_lvl: console messages display level
         :param log_lvl: loggin file message level
         :param handler_gz: specify which handler to zip else only 'log' handler is zipped.
+        :param queued: hand records to a background thread so console and file I/O do not block the caller
+        :param queue_size: max records waiting in the queue
+        :param overflow: what to do when the queue is full, 'drop' or 'block'
+        :param max_bytes: rotate the log file at this size and gzip the segment in the background, 0 to disable
+        :param rotate_interval: rotate the log file after this many seconds, 0 to disable
+        :param backup_count: max archives kept in log_path, 0 for no limit
+        :param max_archive_bytes: max total size of archives kept in log_path, 0 for no limit
+        :param host_timeout: seconds the background lookup of the host IP and user name is waited for before the
+                             banner logs them as unresolved
         """
         assert isinstance(log_path, (str, pathlib.PurePath)), "log_path can only be a string or Path object"
 
@@ -37,33 +232,48 @@ class Log:
         self.base = h.getparentfname(suffix=False)
         self.base_path = log_path / self.base
         self.handler_gz = handler_gz
+        self.today_datetime = h.date_delta(fmt="%Y%m%d-%H%M.%S")
 
         formatters = {
             'detailed': {
                 'class': 'logging.Formatter',
-                'format': '%(asctime)s %(levelname)-8s %(message)s',
+                'format': '%(asctime)s %(levelname)-8s %(trace)s %(message)s',
                 'datefmt': '%Y%m%d-%H%M.%S'
             },
             'simple': {
-                'class': 'logging.Formatter',
-                'format': '%(levelname)-8s %(message)s',
+                '()': ColorFormatter,
+                'fmt': '%(levelname)-8s %(trace)s %(message)s',
                 'datefmt': '%Y%m%d-%H%M.%S'
             }
         }
+        filters = {
+            # caller location is only formatted for records that passed the level check
+            'trace': {
+                '()': TraceFilter
+            }
+        }
         handlers = {
             # show INFO and aboce in console messages
             'console': {
                 'class': 'logging.StreamHandler',
                 'level': con_lvl,
-                'formatter': 'simple'
+                'formatter': 'simple',
+                'filters': ['trace']
             },
             # log DEBUG messages and above into a file
             'log': {
-                'class': 'logging.FileHandler',
+                '()': ArchivingFileHandler,
                 'filename': f"{self.base_path.with_suffix('.log.txt')}",
+                'archive_prefix': f"{log_path / self.base}-{self.today_datetime}.{h.getuser()}",
+                'module': self.base,
+                'max_bytes': max_bytes,
+                'interval': rotate_interval,
+                'backup_count': backup_count,
+                'max_archive_bytes': max_archive_bytes,
                 'mode': 'w',
                 'level': log_lvl,
                 'formatter': 'detailed',
+                'filters': ['trace'],
                 'encoding': 'utf-8'
             }
         }
@@ -79,13 +289,28 @@ class Log:
         self.config = {
             'version': 1,
             'formatters': formatters,
+            'filters': filters,
             'handlers': handlers,
             'loggers': loggers
         }
 
         # initialize log object
+        if os.name == 'nt':
+            self._enable_ansi_windows()
         logging.config.dictConfig(self.config)
         log = self.get_logger()
+        self.handlers = {handler.name: handler for handler in log.handlers}
+
+        self.listener = None
+        if queued:
+            # move console/file handlers behind a queue, served by a listener thread
+            handlers = list(log.handlers)
+            queue_handler = BoundedQueueHandler(Queue(maxsize=queue_size), overflow=overflow)
+            for handler in handlers:
+                log.removeHandler(handler)
+            log.addHandler(queue_handler)
+            self.listener = QueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+            self.listener.start()
 
         # add exception handling
         # https://stackoverflow.com/questions/8050775/using-pythons-logging-module-to-log-all-exceptions-and-errors/8054179#8054179
@@ -94,27 +319,15 @@ class Log:
             if issubclass(exc_type, KeyboardInterrupt):
                 sys.__excepthook__(exc_type, exc_value, exc_tb)
                 return
-            logger.error("Uncaught exception", exc_info=(exc_type, exc_value, exc_tb))
+            log.error("Uncaught exception", exc_info=(exc_type, exc_value, exc_tb))
 
         sys.excepthook = exception_handler
 
-        # set color to output
-        if os.name == 'nt':
-            logging.StreamHandler.emit = self._add_color_to_emit_windows(logging.StreamHandler.emit)
-        else:
-            logging.StreamHandler.emit = self._add_color_to_emit_ansi(logging.StreamHandler.emit)
-
-        hostname = socket.gethostname()
-        ip_addr = socket.gethostbyname_ex(hostname)[2]
-        self.today_datetime = h.date_delta(fmt="%Y%m%d-%H%M.%S")
         info = {
             'Desc': desc,
             'Module': self.base,
             'Date': self.today_datetime,
             'User': h.getuser(),
-            'Name': h.getusername(),
-            'Host': hostname,
-            'IP': ip_addr,
             'cwd': os.getcwd(),
             "log dir": log_path
         }
@@ -123,12 +336,65 @@ class Log:
         for logger in [log]:
             for key, val in info.items():
                 logger.info(info_fmt.format(key, val))
-                # when script runs finish run the _export function
-                atexit.register(self._export)
+
+        # name resolution blocks for seconds without network, the host lines are logged once it is done
+        self.host = {}
+        self.resolved = threading.Event()
+        threading.Thread(target=self._resolve_host, name="log-host", daemon=True).start()
+        threading.Thread(target=self._log_host, args=(log, info_fmt, host_timeout), name="log-banner",
+                         daemon=True).start()
+        # when script runs finish run the _export function, after queued records are written (atexit is LIFO)
+        atexit.register(self._export)
+        atexit.register(self.stop)
+
+    def _resolve_host(self):
+        import socket
+
+        hostname = socket.gethostname()
+        try:
+            ip_addr = socket.gethostbyname_ex(hostname)[2]
+        except OSError as e:
+            ip_addr = f"unresolved ({e})"
+        self.host = {'Name': h.getusername(), 'Host': hostname, 'IP': ip_addr}
+        self.resolved.set()
+
+    def _log_host(self, log: logging.Logger, info_fmt: str, timeout: float):
+        if not self.resolved.wait(timeout):
+            log.info(info_fmt.format('IP', f"unresolved after {timeout}s"))
+            return
+        for key, val in self.host.items():
+            log.info(info_fmt.format(key, val))
+
+    def host_info(self, timeout: float = None) -> dict:
+        """
+        :param timeout: seconds to wait for the background lookup, None waits until it is done
+        :return: {'Name', 'Host', 'IP'}, empty when the lookup is not done yet
+        """
+        self.resolved.wait(timeout)
+        return dict(self.host)
+
+    def stop(self):
+        """
+        write every queued record and stop the listener thread
+        """
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
 
     def get_logger(self, suffix=""):
         return logging.getLogger(f"{self.base}{suffix}")
 
+    @staticmethod
+    def _enable_ansi_windows():
+        """
+        let the Windows console render the ANSI colors of ColorFormatter
+        """
+        try:
+            import colorama
+            colorama.init()
+        except ImportError:
+            pass
+
     def _export(self):
         """
         Specify where to save the history of logs
@@ -137,89 +403,12 @@ class Log:
             self.handler_gz = ['log']
 
         for handler in self.handler_gz:
+            if isinstance(self.handlers.get(handler), ArchivingFileHandler):
+                self.handlers[handler].archive()
+                continue
             src = Path(self.config['handlers'][handler]['filename'])
             dst = self.log_path / f"{src.name.split('.')[0]}-{self.today_datetime}.{h.getuser()}" \
                                   f"{''.join(src.suffixes)}.gz"
             with open(src, 'rb') as f_in:
                 with gzip.open(dst, 'wb') as f_out:
                     shutil.copyfileobj(f_in, f_out)
-
-    @staticmethod
-    def _add_color_to_emit_windows(fn):
-        def _set_color(self, code):
-            import ctypes
-            # Constants from the windows API
-            self.STD_OUTPUT_HANDLE = -11
-            hdl = ctypes.windll.kernel32.GetStdHandle(self.STD_OUTPUT_HANDLE)
-            ctypes.windll.kernel32.SetConsoleTextAttribute(hdl, code)
-
-        setattr(logging.StreamHandler, '_set_color', _set_color)
-
-        def new(*args):
-            FOREGROUND_BLUE = 0x0001  # text color contains blue.
-            FOREGROUND_GREEN = 0x0002  # text color contains green.
-            FOREGROUND_RED = 0x0004  # text color contains red.
-            FOREGROUND_WHITE = FOREGROUND_BLUE | FOREGROUND_GREEN | FOREGROUND_RED
-
-            # wincon.h
-            FOREGROUND_GREEN = 0x0002
-            FOREGROUND_RED = 0x0004
-            FOREGROUND_MAGENTA = 0x0005
-            FOREGROUND_YELLOW = 0x0006
-            FOREGROUND_INTENSITY = 0x0008  # foreground color is intensified.
-
-            BACKGROUND_YELLOW = 0x0060
-            BACKGROUND_INTENSITY = 0x0080  # background color is intensified.
-
-            levelno = args[1].levelno
-            if levelno >= 50:
-                color = BACKGROUND_YELLOW | FOREGROUND_RED | FOREGROUND_INTENSITY | BACKGROUND_INTENSITY
-            elif levelno >= 40:
-                color = FOREGROUND_RED | FOREGROUND_INTENSITY
-            elif levelno >= 30:
-                color = FOREGROUND_YELLOW | FOREGROUND_INTENSITY
-            elif levelno >= 20:
-                color = FOREGROUND_GREEN
-            elif levelno >= 10:
-                color = FOREGROUND_MAGENTA
-            else:
-                color = FOREGROUND_WHITE
-
-            args[0]._set_color(color)
-            ret = fn(*args)
-            args[0]._set_color(FOREGROUND_WHITE)
-            # print "after"
-            return ret
-
-        return new
-
-    @staticmethod
-    def _add_color_to_emit_ansi(emit):
-        """
-        (NON-WINDOWS)
-        Takes in Logging.StreamHandler.emit and insert coloring to them
-        :param emit: Logging.StreamHandler.emit object
-        :return : colored Logging.StreamHandler.emit object
-        """
-
-        # add methods we need to the class
-        def new_emit(*args):
-            levelno = args[1].levelno
-            if levelno >= 50:
-                color = '\x1b[31m'  # red
-            elif levelno >= 40:
-                color = '\x1b[31m'  # red
-            elif levelno >= 30:
-                color = '\x1b[33m'  # yellow
-            elif levelno >= 20:
-                color = '\x1b[32m'  # green
-            elif levelno >= 10:
-                color = '\x1b[35m'  # pink
-            else:
-                color = '\x1b[0m'  # normal
-
-            args[1].msg = color + args[1].msg + '\x1b[0m'  # normal
-            # print "after"
-            return emit(*args)
-
-        return new_emit
@@ -2,26 +2,65 @@ import pathlib
 import time
 from typing import Union, Set
 
-import pyautogui
-import win32api
-import win32con
+from azurlane.frame import Frame, ScreenSource
+from azurlane.inputs import InputBackend, input_backend
+from azurlane.matcher import Match
+from azurlane.templates import Template
 
 
 class Button:
+    # where clicks are sent, win32 on Windows else pyautogui, picked with pybot --input
+    input: InputBackend = input_backend()
+
     def __init__(self,
                  img_path: Union[str, pathlib.PurePath] = "",
                  coords: Set = (),
                  confidence: float = 0.8,
-                 grayscale: bool = True) -> None:
-
-        assert img_path != "" or len(coords) != 0, "Either img_path or coords must have value"
+                 grayscale: bool = True,
+                 frame: Frame = None,
+                 template: Template = None,
+                 match: Match = None,
+                 name: str = None) -> None:
+        """
+        :param img_path: template image to look for
+        :param coords: (left, top, width, height) of a known button, used when img_path is not given
+        :param confidence: minimum match confidence
+        :param grayscale: match in grayscale
+        :param frame: pre-captured Frame to search in, else a fresh screenshot is taken
+        :param template: cached grayscale Template, used instead of decoding img_path
+        :param match: result of a MultiMatcher lookup, nothing is searched
+        :param name: name used in logs and metrics, defaults to the template name
+        """
+        assert img_path != "" or len(coords) != 0 or template is not None or match is not None, \
+            "Either img_path, coords, template or match must have value"
+        self.confidence = 0.0
 
         # init path object
         img_path = img_path if isinstance(img_path, str) else str(img_path)
+        if name is None:
+            name = match.name if match is not None else template.name if template is not None else \
+                pathlib.Path(img_path).name
+        self.name = name
 
         # locate button on monitor
-        if img_path != "":
-            find_ui = pyautogui.locateOnScreen(img_path, confidence=confidence, grayscale=grayscale)
+        if match is not None:
+            self.confidence = match.confidence
+            self.is_exist = match.hit
+            self.left, self.top, self.width, self.height = match.box if match.hit else (0, 0, 0, 0)
+        elif template is not None:
+            frame = ScreenSource().grab() if frame is None else frame
+            self.confidence, find_ui = template.match(frame.gray)
+
+            self.is_exist = self.confidence >= confidence
+            self.left, self.top, self.width, self.height = find_ui if self.is_exist else (0, 0, 0, 0)
+        elif img_path != "":
+            import pyautogui
+
+            if frame is None:
+                find_ui = pyautogui.locateOnScreen(img_path, confidence=confidence, grayscale=grayscale)
+            else:
+                haystack = frame.gray if grayscale else frame.image
+                find_ui = pyautogui.locate(img_path, haystack, confidence=confidence, grayscale=grayscale)
 
             self.is_exist = False if find_ui is None else True
             self.left, self.top, self.width, self.height = find_ui if find_ui is not None else (0, 0, 0, 0)
@@ -30,20 +69,28 @@ class Button:
             self.left, self.top, self.width, self.height = coords
 
     def click_gui(self, delay=1):
+        import pyautogui
+
         x = int(self.left + (self.width / 2))
         y = int(self.top + (self.height / 2))
         pyautogui.click(x=x, y=y)
         time.sleep(delay)
 
-    def click_win32(self, delay=1):
+    def click(self, delay=1, hold=0.5, backend: InputBackend = None):
+        """
+        click the center of the button with the selected input backend
+        :param delay: seconds to sleep after the click
+        :param hold: seconds the button is held down
+        :param backend: input backend of the instance the button belongs to, defaults to Button.input
+        """
         x = int(self.left + (self.width / 2))
         y = int(self.top + (self.height / 2))
-        win32api.SetCursorPos((x, y))
-        win32api.mouse_event(win32con.MOUSEEVENTF_LEFTDOWN, 0, 0)
-        time.sleep(0.5)
-        win32api.mouse_event(win32con.MOUSEEVENTF_LEFTUP, 0, 0)
+        (Button.input if backend is None else backend).click(x, y, hold)
         time.sleep(delay)
 
+    def click_win32(self, delay=1, hold=0.5):
+        self.click(delay=delay, hold=hold)
+
     def exist(self):
         return self.is_exist
 
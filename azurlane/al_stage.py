@@ -1,12 +1,17 @@
 import logging
-import pathlib
-import sys
 import time
-from pathlib import Path
-from typing import Union, Set
+from enum import Enum
+from typing import Set, Dict
 
-import helper as h
 from azurlane.Button import Button
+from azurlane.enhance import Enhance
+from azurlane.frame import FrameSource, ScreenSource
+from azurlane.inputs import InputBackend
+from azurlane.matcher import Match, MultiMatcher
+from azurlane.metrics import Metrics
+from azurlane.roi import RoiTracker
+from azurlane.templates import TemplateCache
+from azurlane.wait import Waiter
 
 """
 Weakness of pyautogui
@@ -16,135 +21,232 @@ while resizing the UI.
 """
 
 
+class Screen(Enum):
+    MAIN_MENU = "main menu"
+    STAGE_SELECT = "stage select"
+    FLEET_SELECT = "fleet select"
+    BATTLE = "battle"
+    DOCK_FULL = "dock full"
+    RESULT = "result"
+
+
+# button that identifies a screen and is clicked to leave it
+SCREEN_BUTTONS = {Screen.MAIN_MENU: "battle.png",
+                  Screen.STAGE_SELECT: "stage_12.png",
+                  Screen.FLEET_SELECT: "go.png",
+                  Screen.DOCK_FULL: "enhance2.png",
+                  Screen.RESULT: "continue.png"}
+SCREEN_LABELS = {Screen.MAIN_MENU: "Battle",
+                 Screen.STAGE_SELECT: "Stage 12",
+                 Screen.FLEET_SELECT: "Go",
+                 Screen.RESULT: "Continue"}
+# screens that can follow the state Stage is in, only their buttons are matched while waiting
+NEXT_SCREENS = {None: tuple(SCREEN_BUTTONS),
+                Screen.MAIN_MENU: (Screen.STAGE_SELECT, Screen.MAIN_MENU),
+                Screen.STAGE_SELECT: (Screen.FLEET_SELECT, Screen.STAGE_SELECT, Screen.DOCK_FULL),
+                Screen.BATTLE: (Screen.RESULT, Screen.DOCK_FULL),
+                Screen.RESULT: (Screen.STAGE_SELECT, Screen.FLEET_SELECT, Screen.RESULT, Screen.DOCK_FULL)}
+# seconds to wait for the next screen before checking every screen again, battles take long
+SCREEN_TIMEOUTS = {Screen.BATTLE: 600}
+DEFAULT_TIMEOUT = 15
+# seconds before the screen that was just acted on is accepted again, i.e. the click did not register
+REPEAT_AFTER = 2.0
+
+# templates that can show up on screen during Stage.run, with their confidence
+RUN_GROUP = {name: 0.8 for name in SCREEN_BUTTONS.values()}
+# seconds a click is held down by default
+CLICK_HOLD = 0.2
+# buttons always drawn in the bottom right quarter of the game, (left, top, width, height) as frame fractions
+ROI_HINTS = {"continue.png": (0.5, 0.5, 0.5, 0.5),
+             "go.png": (0.5, 0.5, 0.5, 0.5),
+             "auto-search.png": (0.5, 0.5, 0.5, 0.5),
+             "battle.png": (0.5, 0.5, 0.5, 0.5)}
+
+
 class Stage:
     def __init__(self,
-                 gui_path: Union[pathlib.PurePath, str],
+                 templates: TemplateCache,
+                 scale: float,
                  back_coords: Set,
                  battle_coords: Set,
-                 log: logging) -> None:
-        self.gui_path = Path(gui_path) if isinstance(gui_path, str) else gui_path
+                 log: logging,
+                 source: FrameSource = None,
+                 matcher: MultiMatcher = None,
+                 waiter: Waiter = None,
+                 metrics: Metrics = None,
+                 click_hold: float = CLICK_HOLD,
+                 input_backend: InputBackend = None,
+                 enhance: Enhance = None) -> None:
+        """
+        :param templates: cache of decoded GUI/ship/secretary templates
+        :param scale: scale of the image set that matches the emulator
+        :param back_coords: coords of the back button
+        :param battle_coords: coords of the battle button
+        :param log: logger
+        :param source: where frames are captured from, defaults to the live screen
+        :param matcher: batched template matcher, defaults to a MultiMatcher with ROI tracking
+        :param waiter: waits for templates to show up, defaults to a Waiter on source and matcher
+        :param metrics: records clicks, states and loops, defaults to the metrics of the matcher
+        :param click_hold: seconds a click is held down
+        :param input_backend: where clicks are sent, defaults to Button.input
+        :param enhance: enhances the ships of the dock when it is full, defaults to every ship template
+        """
+        self.templates = templates
+        self.scale = scale
+        self.templates.preload(scale)
         self.log = log
-
-        self.back_btn = Button(coords=back_coords)
-        self.battle_btn = Button(coords=battle_coords)
+        self.source = ScreenSource() if source is None else source
+        if matcher is None:
+            matcher = MultiMatcher(templates, scale, roi=RoiTracker(ROI_HINTS))
+        self.matcher = matcher
+        self.waiter = Waiter(self.source, matcher, log) if waiter is None else waiter
+        self.metrics = matcher.metrics if metrics is None else metrics
+        self.click_hold = click_hold
+        self.input_backend = input_backend
+        self.enhance = Enhance() if enhance is None else enhance
+
+        self.back_btn = Button(coords=back_coords, name="back")
+        self.battle_btn = Button(coords=battle_coords, name="battle")
         self.listener = None
+        self.frame = None
+        self.group = {}  # templates matched together in one pass whenever a lookup misses the current frame
+        self.matches = {}
+        self.hit = None  # name of the template that ended the last wait
+
+        self.state = None  # last screen acted on, None checks every screen
+        self.acted_at = 0.0
+        self.loops = 0
+        self.started = None
 
     def run(self, listener):
+        """
+        one step of the screen state machine: wait for one of the screens that can follow the current one,
+        then act on it
+        """
         self.listener = listener
-
-        # click on stage 12
-        stage_12 = Button(self.gui_path / "stage_12.png")
-        if stage_12.exist():
-            self.log.info(f"{h.trace()} Clicked Stage 12 ...")
-            stage_12.click_win32()
-
-        # click on go
-        rounded_go = Button(self.gui_path / "go.png")
-        if rounded_go.exist():
-            self.log.info(f"{h.trace()} Clicked Go ...")
-            rounded_go.click_win32()
-
-        self._enhance()  # run auto enhance ships to clear dock space
-
-        # after boss is killed click Continue to go next round
-        cont_btn = Button(self.gui_path / "continue.png")
-        if cont_btn.exist():
-            self.log.info(f"{h.trace()} Clicked Continue ...")
-            cont_btn.click_win32()
-
-    def _enhance(self, retries=5):
-        # Click enhance when Dock is full
-        enhance_btn = Button(self.gui_path / "enhance2.png")
-        if enhance_btn.exist():
-            self.log.info(f"{h.trace()} Clicked Enhance from Prompt ...")
-            enhance_btn.click_win32()
-
-            ships = [x for x in self.gui_path.iterdir() if "ship" in x.name]
-
-            for ship in ships:
-                self._enhance_ship(ship, retries=retries)
-
-            self.log.info(f"Done with enhancing.")
-            self.log.info(f"{h.trace()} Click Back Button ...")
-            self.back_btn.click_win32()
-
-            retry = 0
-            time.sleep(3)
-            while retry < retries + 1:
-                as_btn = Button(self.gui_path / 'auto-search.png')
-                if as_btn.exist():
-                    self.log.info(f"{h.trace()} Click auto-search to Continue Farming ...")
-                    as_btn.click_win32()
-                    break
-                else:
-                    self.log.debug(f"{h.trace()} Retrying ({retry}/{retries}) Find Auto-search btn")
-                    retry += 1
-
-    def _enhance_ship(self, ship_gui_path, retries=5):
-        self.log.info(f"{h.trace()} Enhancing {ship_gui_path.name}")
-        retry, clicked = 0, False
-        while retry < retries + 1:
-            ship_btn = Button(ship_gui_path)
-            if ship_btn.exist():
-                self.log.info(f"{h.trace()} Clicked Ship1 ...")
-                ship_btn.click_win32()
-                clicked = True
-                break
-            else:
-                self.log.debug(f"{h.trace()} Retrying ({retry}/{retries}) Find {ship_gui_path.name} btn")
-                retry += 1
-
-        if not clicked:
+        if self.started is None:
+            self.started = time.time()
+
+        screens = NEXT_SCREENS[self.state]
+        timeout = SCREEN_TIMEOUTS.get(self.state, DEFAULT_TIMEOUT)
+        screen, btn = self._wait_screen(screens, timeout)
+        if screen is None:
+            if self._running():
+                self.log.warning(f"None of {[x.value for x in screens]} showed up after {timeout}s "
+                                 f"on {self.state}, checking every screen")
+            self.state = None
             return
 
-        # iteratively enhance until unable to
-        while True:
-            result = self._enhance_process()
-            if result == 'break':
-                break
-            if not self.listener.running:
-                self.log.info(f"{h.trace()} Force Ending Process")
-                sys.exit(1)
-
-    def _enhance_process(self):
-        fill_btn = Button(self.gui_path / "fill.png", confidence=0.7)
-        if fill_btn.exist():
-            self.log.info(f"{h.trace()} Clicked Fill Btn ...")
-            fill_btn.click_win32()
-
-        not_enough = Button(self.gui_path / "not_enough.png")
-        if not_enough.exist():
-            self.log.info(f"{h.trace()} Not Enough to enhance ...")
-            self.log.info(f"{h.trace()} Click Back Button ...")
-            self.back_btn.click_win32()
-            return 'break'
-
-        enhance2_btn = Button(self.gui_path / "enhance.png")
-        if enhance2_btn.exist():
-            self.log.info(f"{h.trace()} Clicked Enhance Gold ...")
-            enhance2_btn.click_win32()
-
-        not_enough = Button(self.gui_path / "not_enough.png")
-        if not_enough.exist():
-            self.log.info(f"{h.trace()} Not Enough to enhance ...")
-            self.log.info(f"{h.trace()} Click Back Button ...")
-            self.back_btn.click_win32()
-            return 'break'
-
-        # Continue to disassemble Gear
-        cont_btn = Button(self.gui_path / "confirm.png")
-        if cont_btn.exist():
-            self.log.info(f"{h.trace()} Clicked Confirm ...")
-            cont_btn.click_win32()
-
-        dis_btn = Button(self.gui_path / "disassemble.png")
-        if dis_btn.exist():
-            self.log.info(f"{h.trace()} Click Disassemble ...")
-            dis_btn.click_win32()
-
-        tap_cont = Button(self.gui_path / "ttc.png")
-        if tap_cont.exist():
-            self.log.info(f"{h.trace()} Click Tap to continue ...")
-            tap_cont.click_win32()
-
-        return 'continue'
+        self.state = self._act(screen, btn)
+        self.acted_at = time.time()
+
+    def loops_per_hour(self) -> float:
+        elapsed = 0 if self.started is None else time.time() - self.started
+        return self.loops / elapsed * 3600 if elapsed > 0 else 0.0
+
+    def report(self):
+        """
+        log farming throughput, transition latencies and ROI hit/miss statistics of every template looked up
+        """
+        self.log.info(f"Finished {self.loops} loops, {self.loops_per_hour():.1f} loops/hour")
+        self.waiter.report()
+        self.log.info(f"Dock: {self.enhance}")
+        if self.metrics is not None:
+            self.metrics.flush()
+            self.metrics.report(self.log)
+        if self.matcher.roi is None:
+            return
+        for name, roi in sorted(self.matcher.roi.stats().items()):
+            self.log.info(f"ROI {name}: {roi}")
+
+    def _running(self) -> bool:
+        return self.listener is None or self.listener.running
+
+    def _wait_screen(self, screens, timeout):
+        """
+        wait until the button of one of the screens shows up, only those buttons are matched
+        :return: (screen, button) or (None, None) on timeout or when the listener stopped
+        """
+        group = {SCREEN_BUTTONS[screen]: 0.8 for screen in screens}
+        # the clicked button stays visible while the screen animates away, only click again if it stays
+        after = {}
+        if self.state in SCREEN_BUTTONS:
+            after[SCREEN_BUTTONS[self.state]] = max(REPEAT_AFTER - (time.time() - self.acted_at), 0)
+
+        transition = f"{'any' if self.state is None else self.state.value} -> next screen"
+        btn = self._wait(group, timeout, transition=transition, after=after)
+        if not btn.exist():
+            return None, None
+        screen = next(x for x in screens if SCREEN_BUTTONS[x] == self.hit)
+        return screen, btn
+
+    def _act(self, screen, btn):
+        """
+        act on a screen that just showed up
+        :return: state to continue from
+        """
+        if screen is Screen.DOCK_FULL:
+            self._enhance(btn)  # run auto enhance ships to clear dock space
+            return Screen.BATTLE
+
+        self.log.info(f"Clicked {SCREEN_LABELS[screen]} ...")
+        self._click(btn, delay=0)  # no fixed sleep, the next screen is waited for
+        if screen is Screen.FLEET_SELECT:
+            return Screen.BATTLE
+        if screen is Screen.RESULT:
+            # after boss is killed click Continue to go next round
+            self.loops += 1
+            if self.metrics is not None:
+                self.metrics.loop()
+            self.log.info(f"Loop {self.loops} done, {self.loops_per_hour():.1f} loops/hour")
+        return screen
+
+    def _snap(self, group: Dict[str, float] = None):
+        """
+        capture a new frame, every following _find is matched against it
+        :param group: {name: confidence} of templates expected on the next frames, batch matched together
+        """
+        if group is not None:
+            self.group = group
+        self.frame = self.source.grab()
+        self.matches = {}
+        return self.frame
+
+    def _find(self, img_name, confidence=0.8):
+        if img_name not in self.matches:
+            group = dict(self.group)
+            group[img_name] = confidence
+            self.matches.update(self.matcher.match(self.frame, group))
+        return Button(match=self.matches[img_name]._replace(threshold=confidence))
+
+    def _wait(self, group: Dict[str, float], timeout, transition=None, after=None) -> Button:
+        """
+        wait until one of the templates shows up, the polled frame and its matches become the current ones
+        :return: button of the best hit, check exist()
+        """
+        match = self.waiter.wait_for(group, timeout, transition=transition, stop=lambda: not self._running(),
+                                     after=after)
+        self.group, self.frame, self.matches = group, self.waiter.frame, dict(self.waiter.matches)
+        self.hit = None if match is None else match.name
+        if match is not None and self.metrics is not None:
+            self.metrics.state(match.name)
+        return Button(match=match) if match is not None else Button(match=Match("", 0.0))
+
+    def _click(self, btn, delay=1, expect: Dict[str, float] = None, transition=None):
+        """
+        click on button, screen changes after a click so current frame is replaced
+        :param delay: seconds to wait after the click, returns early when expect is given and shows up
+        :param expect: {name: confidence} of templates the click leads to
+        """
+        btn.click(delay=0, hold=self.click_hold, backend=self.input_backend)
+        if self.metrics is not None:
+            self.metrics.click(btn.name, self.scale, btn.confidence)
+        if expect is None:
+            time.sleep(delay)
+            self._snap()
+        else:
+            self._wait(expect, delay, transition=transition)
+
+    def _enhance(self, enhance_btn):
+        # Click enhance when Dock is full
+        self.enhance.run(self, enhance_btn)
@@ -0,0 +1,137 @@
+import json
+import os
+import pathlib
+import struct
+from pathlib import Path
+from typing import Union, List, Dict, Tuple, Optional
+
+import numpy as np
+
+MAGIC = b"PYBOTBNK"
+VERSION = 1
+ALIGN = 64  # every array starts on a cache line
+BANK_FILE = "templates.bank"
+
+
+def _source_stat(path: pathlib.PurePath) -> List:
+    stat = Path(path).stat()
+    return [stat.st_size, stat.st_mtime_ns, stat.st_mtime]
+
+
+class TemplateBank:
+    def __init__(self, path: Union[pathlib.PurePath, str]) -> None:
+        """
+        Grayscale arrays of every template and scale packed in one file and opened with numpy.memmap: get() returns
+        views into the mapped file, nothing is decoded or copied and processes on one host share the same pages.
+        Layout: MAGIC, index length (uint64 little endian), json index, arrays aligned to ALIGN bytes. The index
+        holds version, the size and mtime of every source image and {name, scale, shape, offset} per array.
+        :param path: bank written by TemplateBank.build
+        """
+        self.path = Path(path)
+        with open(self.path, "rb") as f:
+            assert f.read(len(MAGIC)) == MAGIC, f"{self.path} is not a template bank"
+            length, = struct.unpack("<Q", f.read(8))
+            index = json.loads(f.read(length))
+        assert index["version"] == VERSION, f"{self.path} has bank version {index['version']}, expected {VERSION}"
+
+        self.sources: Dict[str, List] = index["sources"]  # {path: [size, mtime_ns, mtime]}
+        self.entries: Dict[Tuple[str, float], Dict] = {(x["name"], x["scale"]): x for x in index["templates"]}
+        self.data = np.memmap(self.path, dtype=np.uint8, mode="r")
+
+    @classmethod
+    def open(cls, path: Union[pathlib.PurePath, str]) -> Optional["TemplateBank"]:
+        """
+        :return: bank, None when the file is missing or unreadable
+        """
+        try:
+            return cls(path)
+        except (OSError, ValueError, KeyError, AssertionError, struct.error):
+            return None
+
+    def get(self, name: str, scale: float = 1.0) -> Optional[np.ndarray]:
+        """
+        :return: read only view of the grayscale template, None if it is not in the bank
+        """
+        entry = self.entries.get((name, round(scale, 2)))
+        if entry is None:
+            return None
+        height, width = entry["shape"]
+        return self.data[entry["offset"]:entry["offset"] + height * width].reshape(height, width)
+
+    def has(self, name: str, scale: float = 1.0) -> bool:
+        return (name, round(scale, 2)) in self.entries
+
+    def scales(self) -> List[float]:
+        return sorted({scale for _, scale in self.entries}, reverse=True)
+
+    def mtime(self, path: pathlib.PurePath) -> Optional[float]:
+        """
+        :return: st_mtime the source image had when the bank was built, compared by Template.is_stale
+        """
+        stat = self.sources.get(str(path))
+        return None if stat is None else stat[2]
+
+    def fresh(self, paths: Dict[Tuple[str, float], pathlib.PurePath]) -> bool:
+        """
+        :param paths: TemplateCache.paths
+        :return: False when an original template was added, or a source image changed since the bank was built
+        """
+        originals = {str(path) for (name, scale), path in paths.items() if scale == 1.0}
+        if not originals <= set(self.sources):
+            return False
+        for source, stat in self.sources.items():
+            if not os.path.isfile(source) or _source_stat(source) != stat:
+                return False
+        return True
+
+    def close(self):
+        # numpy.memmap has no close, dropping the last reference unmaps the file
+        self.data = None
+
+    @staticmethod
+    def build(path: Union[pathlib.PurePath, str], templates, scales: List[float]) -> int:
+        """
+        pack every template of the cache at each scale, written next to path first and renamed over it
+        :param templates: TemplateCache to pack, scales without an image set are resized in memory
+        :param scales: scales to pack, 1.0 is always included
+        :return: number of arrays written
+        """
+        path = Path(path)
+        scales = sorted({round(x, 2) for x in scales} | {1.0}, reverse=True)
+        arrays, entries, sources = [], [], {}
+        for scale in scales:
+            for name in templates.names(scale):
+                template = templates.get(name, scale)
+                source = templates.paths.get((name, scale), templates.paths.get((name, 1.0)))
+                if source is not None:
+                    sources[str(source)] = _source_stat(source)
+                arrays.append(np.ascontiguousarray(template.gray, dtype=np.uint8))
+                entries.append({"name": name, "scale": scale, "shape": list(template.shape)})
+
+        # offsets start after the index and the index holds the offsets, repeat until both agree
+        def header(offset_base):
+            offset = offset_base
+            for entry, array in zip(entries, arrays):
+                entry["offset"] = offset
+                offset += -(-array.size // ALIGN) * ALIGN
+            return json.dumps({"version": VERSION, "sources": sources, "templates": entries}).encode()
+
+        base = 0
+        while True:
+            index = header(base)
+            start = -(-(len(MAGIC) + 8 + len(index)) // ALIGN) * ALIGN
+            if start == base:
+                break
+            base = start
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        with open(tmp, "wb") as f:
+            f.write(MAGIC)
+            f.write(struct.pack("<Q", len(index)))
+            f.write(index)
+            for entry, array in zip(entries, arrays):
+                f.write(b"\0" * (entry["offset"] - f.tell()))
+                f.write(array.tobytes())
+        os.replace(tmp, path)
+        return len(arrays)
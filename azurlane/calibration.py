@@ -0,0 +1,80 @@
+import json
+import pathlib
+from pathlib import Path
+from typing import Union, Tuple, Dict, Optional
+
+import helper as h
+
+
+class CalibrationStore:
+    def __init__(self, path: Union[pathlib.PurePath, str], digest: str = None) -> None:
+        """
+        Calibrated GUI scale, button coordinates and learned ROIs persisted across runs, keyed by window size and
+        template digest. Coordinates are relative to the captured window, so moving it does not invalidate them.
+        :param path: json file, created on first save
+        :param digest: TemplateCache.digest(), entries of other template sets are ignored
+        """
+        self.path = Path(path)
+        self.digest = digest
+        self.data = json.loads(self.path.read_text()) if self.path.is_file() else {}
+
+    def key(self, size: Tuple[int, int]) -> str:
+        key = f"{size[0]}x{size[1]}"
+        return key if self.digest is None else f"{key}-{self.digest[:12]}"
+
+    def get(self, size: Tuple[int, int], mode: str):
+        """
+        :param size: (width, height) of the captured frame
+        :param mode: 'disk' or 'memory', a scale found in memory might not have a disk image set
+        :return: stored scale or None
+        """
+        entry = self.data.get(self.key(size), {}).get(mode)
+        return None if entry is None else entry["scale"]
+
+    def put(self, size: Tuple[int, int], mode: str, scale: float, confidence: float):
+        self.data.setdefault(self.key(size), {})[mode] = {
+            "scale": scale,
+            "confidence": round(confidence, 4),
+            "date": h.date_delta(fmt="%Y%m%d-%H%M.%S")
+        }
+        self.save()
+
+    def get_buttons(self, size: Tuple[int, int], scale: float) -> Optional[Dict]:
+        """
+        :return: {'back': [l, t, w, h], 'back_name': secretary, 'battle': [l, t, w, h], 'rois': {name: box}} found
+                 at this scale, None if not stored
+        """
+        entry = self.data.get(self.key(size), {}).get("buttons")
+        return entry if entry is not None and entry["scale"] == scale else None
+
+    def put_buttons(self, size: Tuple[int, int], scale: float, back: Tuple, back_name: str, battle: Tuple,
+                    rois: Dict[str, Tuple] = None):
+        previous = self.get_buttons(size, scale) or {}
+        self.data.setdefault(self.key(size), {})["buttons"] = {
+            "scale": scale,
+            "back": list(back),
+            "back_name": back_name,
+            "battle": list(battle),
+            "rois": {name: list(box) for name, box in (rois or previous.get("rois", {})).items()},
+            "date": h.date_delta(fmt="%Y%m%d-%H%M.%S")
+        }
+        self.save()
+
+    def put_rois(self, size: Tuple[int, int], scale: float, rois: Dict[str, Tuple]):
+        """
+        update the learned ROIs of stored buttons, e.g. at the end of a run
+        """
+        entry = self.get_buttons(size, scale)
+        if entry is not None:
+            self.put_buttons(size, scale, entry["back"], entry["back_name"], entry["battle"], rois)
+
+    def drop(self, size: Tuple[int, int]):
+        """
+        forget the scale and buttons stored for a window size, e.g. when the stored buttons are not on screen
+        """
+        if self.data.pop(self.key(size), None) is not None:
+            self.save()
+
+    def save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.path.write_text(json.dumps(self.data, indent=2))
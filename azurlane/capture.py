@@ -0,0 +1,153 @@
+import importlib.util
+import subprocess
+import threading
+import time
+from typing import Tuple
+
+import cv2
+import numpy as np
+
+from azurlane.frame import Frame, FrameSource, ScreenSource
+
+
+class MssSource(FrameSource):
+    def __init__(self, monitor: int = 1) -> None:
+        """
+        Capture the screen, or only the window when one is set, with mss, several times faster than pyautogui
+        :param monitor: mss monitor index captured when no window is set, 1 is the primary monitor
+        """
+        super().__init__()
+        self.monitor = monitor
+        self.local = threading.local()  # mss handles can not be shared between threads
+
+    def grab(self) -> Frame:
+        region = self.region()
+        if region is None:
+            return self.grab_monitor(self.monitor)
+        return self._grab(region)
+
+    def grab_monitor(self, monitor: int) -> Frame:
+        """
+        :param monitor: mss monitor index, 0 is every monitor together
+        """
+        area = self._sct().monitors[monitor]
+        return self._grab((area["left"], area["top"], area["width"], area["height"]))
+
+    def monitor_for(self, region: Tuple[int, int, int, int]) -> int:
+        """
+        :param region: (left, top, width, height) in screen pixels
+        :return: index of the monitor region lies on, 0 (every monitor) when it spans several
+        """
+        left, top, width, height = region
+        for idx, area in enumerate(self._sct().monitors[1:], 1):
+            if area["left"] <= left and left + width <= area["left"] + area["width"] and \
+                    area["top"] <= top and top + height <= area["top"] + area["height"]:
+                return idx
+        return 0
+
+    def _sct(self):
+        if not hasattr(self.local, "sct"):
+            import mss
+
+            self.local.sct = mss.mss()
+        return self.local.sct
+
+    def _grab(self, region: Tuple[int, int, int, int]) -> Frame:
+        area = dict(zip(("left", "top", "width", "height"), region))
+        started = time.perf_counter()
+        image = np.asarray(self._sct().grab(area))
+        return self._new_frame(cv2.cvtColor(image, cv2.COLOR_BGRA2BGR), started, region)
+
+
+class Win32Source(FrameSource):
+    """
+    Capture the desktop, or only the window when one is set, with a GDI BitBlt, no extra package needed on Windows
+    """
+
+    @staticmethod
+    def desktop() -> Tuple[int, int, int, int]:
+        """
+        :return: (left, top, width, height) of the virtual screen of every monitor, left or top is negative when
+                 a monitor is left of or above the primary one
+        """
+        import win32api
+        import win32con
+
+        return (win32api.GetSystemMetrics(win32con.SM_XVIRTUALSCREEN),
+                win32api.GetSystemMetrics(win32con.SM_YVIRTUALSCREEN),
+                win32api.GetSystemMetrics(win32con.SM_CXVIRTUALSCREEN),
+                win32api.GetSystemMetrics(win32con.SM_CYVIRTUALSCREEN))
+
+    def grab(self) -> Frame:
+        import win32con
+        import win32gui
+        import win32ui
+
+        started = time.perf_counter()
+        region = self.region()
+        if region is None:
+            region = self.desktop()
+        left, top, width, height = region
+
+        hwnd = win32gui.GetDesktopWindow()
+        window_dc = win32gui.GetWindowDC(hwnd)
+        src_dc = win32ui.CreateDCFromHandle(window_dc)
+        mem_dc = src_dc.CreateCompatibleDC()
+        bitmap = win32ui.CreateBitmap()
+        try:
+            bitmap.CreateCompatibleBitmap(src_dc, width, height)
+            mem_dc.SelectObject(bitmap)
+            mem_dc.BitBlt((0, 0), (width, height), src_dc, (left, top), win32con.SRCCOPY)
+            image = np.frombuffer(bitmap.GetBitmapBits(True), dtype=np.uint8).reshape(height, width, 4)
+        finally:
+            mem_dc.DeleteDC()
+            src_dc.DeleteDC()
+            win32gui.ReleaseDC(hwnd, window_dc)
+            win32gui.DeleteObject(bitmap.GetHandle())
+        return self._new_frame(cv2.cvtColor(image, cv2.COLOR_BGRA2BGR), started, region)
+
+
+class AdbSource(FrameSource):
+    def __init__(self, serial: str = None, adb: str = "adb") -> None:
+        """
+        Capture the emulator through 'adb exec-out screencap', frames are in device pixels
+        :param serial: device serial, e.g. '127.0.0.1:5555' for BlueStacks, None for the only connected device
+        :param adb: adb executable
+        """
+        super().__init__()
+        self.command = [adb] if serial is None else [adb, "-s", serial]
+
+    def grab(self) -> Frame:
+        started = time.perf_counter()
+        png = subprocess.run(self.command + ["exec-out", "screencap", "-p"], check=True, capture_output=True).stdout
+        image = cv2.imdecode(np.frombuffer(png, dtype=np.uint8), cv2.IMREAD_COLOR)
+        assert image is not None, "adb screencap returned no image, is the device connected?"
+        return self._new_frame(image, started)
+
+
+class NullSource(FrameSource):
+    def __init__(self, size: Tuple[int, int] = (1280, 720)) -> None:
+        """
+        Black frames, measures the bot without capture cost
+        :param size: (width, height)
+        """
+        super().__init__()
+        self.image = np.zeros((size[1], size[0], 3), dtype=np.uint8)
+
+    def grab(self) -> Frame:
+        return self._new_frame(self.image)
+
+
+CAPTURE_BACKENDS = {"pyautogui": ScreenSource, "mss": MssSource, "win32": Win32Source, "adb": AdbSource,
+                    "null": NullSource}
+
+
+def capture_backend(name: str = "auto", serial: str = None) -> FrameSource:
+    """
+    :param name: key of CAPTURE_BACKENDS, 'auto' picks mss when installed else pyautogui
+    :param serial: device serial for adb
+    """
+    if name == "auto":
+        name = "mss" if importlib.util.find_spec("mss") is not None else "pyautogui"
+    assert name in CAPTURE_BACKENDS, f"Unknown capture backend {name}, choose from {sorted(CAPTURE_BACKENDS)}"
+    return AdbSource(serial) if name == "adb" else CAPTURE_BACKENDS[name]()
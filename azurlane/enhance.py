@@ -0,0 +1,297 @@
+import json
+import pathlib
+import time
+from pathlib import Path
+from typing import Union, List, Dict
+
+import numpy as np
+
+import helper as h
+from azurlane.Button import Button
+from azurlane.matcher import Match
+
+# templates that can show up on screen during _enhance_process, with their confidence
+ENHANCE_GROUP = {"fill.png": 0.7, "not_enough.png": 0.8, "enhance.png": 0.8, "confirm.png": 0.8,
+                 "disassemble.png": 0.8, "ttc.png": 0.8}
+# what each click of _enhance_process leads to, the wait ends as soon as one of them shows up. Enhance is on
+# screen before Fill is clicked too, only not_enough ends the wait early, otherwise the fill settles for 1s
+AFTER_FILL = {"not_enough.png": 0.8}
+AFTER_ENHANCE = {"not_enough.png": 0.8, "confirm.png": 0.8, "disassemble.png": 0.8, "ttc.png": 0.8}
+AFTER_CONFIRM = {"disassemble.png": 0.8, "ttc.png": 0.8}
+AFTER_DISASSEMBLE = {"ttc.png": 0.8}
+AFTER_TTC = {"fill.png": 0.7, "enhance.png": 0.8}
+# back from the enhance screen leads to the dock, or to auto-search when the dock was left
+AFTER_BACK = {"auto-search.png": 0.8}
+# optional GUI image of the label shown on the enhance screen of a fully enhanced ship
+MAXED = "maxed.png"
+# an enhance screen without Fill and Enhance is checked on IDLE_FRAMES frames over IDLE_WAIT seconds
+IDLE_GROUP = {"fill.png": 0.7, "enhance.png": 0.8}
+IDLE_FRAMES = 3
+IDLE_WAIT = 1.5
+AUTO_SEARCH_TIMEOUT = 10
+# dock is scrolled by dragging from the lower to the upper part of the game, as frame height fractions
+SCROLL_FROM, SCROLL_TO = 0.75, 0.35
+# mean gray level difference of the frame signatures below which a scroll did not move the dock
+SCROLL_END = 2.0
+
+
+class Enhance:
+    def __init__(self,
+                 ships: List[str] = None,
+                 state_path: Union[pathlib.PurePath, str] = None,
+                 confidence: float = 0.8,
+                 max_scrolls: int = 3,
+                 max_rounds: int = 10,
+                 timeout: float = 5) -> None:
+        """
+        Enhance every ship of ships_to_enhance that is visible in the dock. One captured frame is matched against
+        all ship templates together, the hits are enhanced in screen order and the dock is only scrolled while
+        ships are still missing. Ships found fully enhanced are remembered and not looked for again.
+        :param ships: ship template names, defaults to every template with 'ship' in its name
+        :param state_path: json file the maxed ships are kept in between runs, None keeps them in memory
+        :param confidence: minimum confidence of a ship match
+        :param max_scrolls: max number of dock scrolls per enhance pass
+        :param max_rounds: max fill/enhance rounds per ship
+        :param timeout: seconds to wait for a ship or its enhance screen
+        """
+        self.ships = ships
+        self.state_path = None if state_path is None else Path(state_path)
+        self.confidence = confidence
+        self.max_scrolls = max_scrolls
+        self.max_rounds = max_rounds
+        self.timeout = timeout
+        self.stage = None
+
+        self.maxed: Dict[str, str] = {}  # {ship: date found maxed}
+        if self.state_path is not None and self.state_path.is_file():
+            self.maxed = json.loads(self.state_path.read_text()).get("maxed", {})
+        self.enhanced = 0
+        self.scrolls = 0
+
+    def pending(self, stage) -> List[str]:
+        """
+        :return: ships still worth looking for
+        """
+        ships = stage.templates.names(stage.scale, contains="ship") if self.ships is None else self.ships
+        return [name for name in ships if name not in self.maxed]
+
+    def reset(self):
+        """
+        forget the maxed ships, e.g. after the ships in ships_to_enhance were replaced
+        """
+        self.maxed = {}
+        self.save()
+
+    def save(self):
+        if self.state_path is None:
+            return
+        self.state_path.parent.mkdir(parents=True, exist_ok=True)
+        self.state_path.write_text(json.dumps({"maxed": self.maxed}, indent=2))
+
+    def run(self, stage, enhance_btn: Button):
+        """
+        dock is full: open the dock from the prompt, enhance the ships found and go back to farming
+        :param stage: Stage the dock prompt showed up on, its frames, matcher and clicks are used
+        :param enhance_btn: enhance button of the dock full prompt
+        """
+        if not enhance_btn.exist():
+            return
+        self.stage = stage
+        pending = self.pending(stage)
+        group = {name: self.confidence for name in pending}
+
+        stage.log.info("Clicked Enhance from Prompt ...")
+        stage._click(enhance_btn, expect=group or None, delay=self.timeout if group else 1,
+                     transition="dock full prompt -> dock")
+        if len(group) == 0:
+            stage.log.info("Every ship to enhance is maxed, nothing to do in the dock")
+        else:
+            self._enhance_dock(group)
+
+        stage.log.info("Done with enhancing.")
+        stage.log.info("Click Back Button ...")
+        stage.back_btn.click(delay=0, hold=stage.click_hold, backend=stage.input_backend)
+        if stage.metrics is not None:
+            stage.metrics.click(stage.back_btn.name)
+
+        as_btn = stage._wait({'auto-search.png': 0.8}, AUTO_SEARCH_TIMEOUT, transition="dock -> auto-search")
+        if as_btn.exist():
+            stage.log.info("Click auto-search to Continue Farming ...")
+            stage._click(as_btn, delay=0)
+        else:
+            stage.log.debug(f"Auto-search btn not found after {AUTO_SEARCH_TIMEOUT}s")
+
+    def _enhance_dock(self, group: Dict[str, float]):
+        """
+        enhance the ships of group visible on the current dock frame, scroll for the ones that are not
+        """
+        stage = self.stage
+        for scroll in range(self.max_scrolls + 1):
+            hits = self._locate(group)
+            stage.log.info(f"Found {[x.name for x in hits]} in the dock, missing "
+                           f"{sorted(set(group) - {x.name for x in hits})}")
+            for match in hits:
+                if not stage._running():
+                    stage.log.info("Force Ending Process")
+                    return
+                self._enhance_ship(match)
+                group.pop(match.name)
+            if len(group) == 0 or scroll == self.max_scrolls or not self._scroll():
+                break
+
+        if len(group) != 0:
+            stage.log.debug(f"{sorted(group)} not found in the dock")
+
+    def _locate(self, group: Dict[str, float]) -> List[Match]:
+        """
+        match every ship of group against the current frame in one pass
+        :return: hits in screen order, row by row from the top left
+        """
+        stage = self.stage
+        if stage.frame is None:
+            stage._snap()
+        missing = {name: confidence for name, confidence in group.items() if name not in stage.matches}
+        if len(missing) != 0:
+            stage.matches.update(stage.matcher.match(stage.frame, missing))
+        hits = [stage.matches[name] for name in group if stage.matches[name].hit]
+        return sorted(hits, key=lambda x: (x.top // max(x.height, 1), x.left))
+
+    def _scroll(self) -> bool:
+        """
+        drag the dock one page down and capture it
+        :return: False when the dock did not move, i.e. its end is reached
+        """
+        stage = self.stage
+        width, height = stage.frame.size
+        before = stage.frame.signature().astype(np.int16)
+        stage.log.info("Scrolling the dock ...")
+        backend = Button.input if stage.input_backend is None else stage.input_backend
+        backend.drag(width // 2, int(height * SCROLL_FROM), width // 2, int(height * SCROLL_TO))
+        if stage.metrics is not None:
+            stage.metrics.click("dock scroll")
+        self.scrolls += 1
+        stage._snap()
+        after = stage.frame.signature().astype(np.int16)
+        return before.shape != after.shape or np.abs(before - after).mean() >= SCROLL_END
+
+    def _enhance_ship(self, match: Match):
+        stage = self.stage
+        ship_name = match.name
+        stage.log.info(f"Enhancing {ship_name}")
+        # a ship enhanced before may have moved the dock, the ROI around its last hit is checked first
+        ship_btn = stage._wait({ship_name: self.confidence}, self.timeout, transition="dock -> ship")
+        if not ship_btn.exist():
+            stage.log.debug(f"{ship_name} btn not found after {self.timeout}s")
+            return
+
+        stage.log.info(f"Clicked {ship_name} ...")
+        stage._click(ship_btn, expect=ENHANCE_GROUP, delay=self.timeout, transition="ship -> enhance screen")
+        if stage.hit is None:
+            stage.log.debug(f"Enhance screen of {ship_name} not found after {self.timeout}s")
+            return
+
+        # iteratively enhance until unable to
+        for idx in range(self.max_rounds):
+            result = self._enhance_process(first=idx == 0)
+            if result == 'maxed':
+                stage.log.info(f"{ship_name} is fully enhanced, it is skipped from now on")
+                self.maxed[ship_name] = h.date_delta(fmt="%Y%m%d-%H%M.%S")
+                self.save()
+                self._back()
+                return
+            if result == 'idle':
+                if self._idle():
+                    # likely maxed, but without maxed.png it is only a guess and is not remembered
+                    stage.log.info(f"{ship_name} shows neither Fill nor Enhance, skipped in this pass")
+                    self._back()
+                    return
+                continue  # enhance screen was still loading
+            if result == 'break':
+                break
+            if not stage._running():
+                return
+            self.enhanced += 1
+        else:
+            stage.log.info(f"{ship_name} still enhancing after {self.max_rounds} rounds, Click Back Button ...")
+            self._back()
+
+    def _enhance_process(self, first: bool = False):
+        """
+        one fill, enhance, confirm, disassemble round on the enhance screen
+        :param first: first round of a ship, the enhance screen is checked for the maxed label
+        :return: 'continue', 'break' when there is nothing left to enhance with, 'maxed' when maxed.png matched
+                 or 'idle' when the first frame shows neither Fill nor Enhance
+        """
+        stage = self.stage
+        stage._snap(ENHANCE_GROUP)
+
+        if first and stage.templates.has(MAXED, stage.scale) and stage._find(MAXED).exist():
+            return 'maxed'
+
+        fill_btn = stage._find("fill.png", confidence=0.7)
+        if fill_btn.exist():
+            stage.log.info("Clicked Fill Btn ...")
+            stage._click(fill_btn, expect=AFTER_FILL, transition="fill ->")
+
+        not_enough = stage._find("not_enough.png")
+        if not_enough.exist():
+            stage.log.info("Not Enough to enhance ...")
+            stage.log.info("Click Back Button ...")
+            self._back()
+            return 'break'
+
+        enhance2_btn = stage._find("enhance.png")
+        if enhance2_btn.exist():
+            stage.log.info("Clicked Enhance Gold ...")
+            stage._click(enhance2_btn, expect=AFTER_ENHANCE, transition="enhance ->")
+        elif first and not fill_btn.exist():
+            return 'idle'
+
+        not_enough = stage._find("not_enough.png")
+        if not_enough.exist():
+            stage.log.info("Not Enough to enhance ...")
+            stage.log.info("Click Back Button ...")
+            self._back()
+            return 'break'
+
+        # Continue to disassemble Gear
+        cont_btn = stage._find("confirm.png")
+        if cont_btn.exist():
+            stage.log.info("Clicked Confirm ...")
+            stage._click(cont_btn, expect=AFTER_CONFIRM, transition="confirm ->")
+
+        dis_btn = stage._find("disassemble.png")
+        if dis_btn.exist():
+            stage.log.info("Click Disassemble ...")
+            stage._click(dis_btn, expect=AFTER_DISASSEMBLE, transition="disassemble ->")
+
+        tap_cont = stage._find("ttc.png")
+        if tap_cont.exist():
+            stage.log.info("Click Tap to continue ...")
+            stage._click(tap_cont, expect=AFTER_TTC, transition="ttc -> enhance screen")
+
+        return 'continue'
+
+    def _back(self):
+        """
+        click back from the enhance screen, the wait ends as soon as a ship of the dock or auto-search shows up
+        """
+        group = {name: self.confidence for name in self.pending(self.stage)}
+        group.update(AFTER_BACK)
+        self.stage._click(self.stage.back_btn, expect=group, transition="enhance screen -> dock")
+
+    def _idle(self) -> bool:
+        """
+        one frame can be taken while the enhance screen is still loading, look again on a few later frames
+        :return: True when neither Fill nor Enhance showed up on any of them
+        """
+        stage = self.stage
+        for _ in range(IDLE_FRAMES):
+            time.sleep(IDLE_WAIT / IDLE_FRAMES)
+            stage._snap(IDLE_GROUP)
+            if any(stage._find(name, confidence).exist() for name, confidence in IDLE_GROUP.items()):
+                return False
+        return True
+
+    def __repr__(self):
+        return f"enhance rounds={self.enhanced} scrolls={self.scrolls} maxed={sorted(self.maxed)}"
@@ -0,0 +1,149 @@
+import pathlib
+import time
+from pathlib import Path
+from typing import Union, List, Tuple
+
+import cv2
+import numpy as np
+
+
+class Frame:
+    def __init__(self,
+                 image: np.ndarray,
+                 index: int = 0,
+                 timestamp: float = None,
+                 capture_ms: float = 0.0,
+                 origin: Tuple[int, int] = (0, 0)) -> None:
+        """
+        Single snapshot of the screen. Every template of one tick is matched against the same Frame
+        :param image: BGR image array (opencv layout)
+        :param index: sequence number given by the frame source
+        :param timestamp: time of capture, defaults to now
+        :param capture_ms: time the capture took
+        :param origin: screen position of the top left pixel, frame coordinates are relative to it
+        """
+        self.image = image
+        self.index = index
+        self.timestamp = time.time() if timestamp is None else timestamp
+        self.capture_ms = capture_ms
+        self.origin = origin
+        self._gray = None
+        self._levels = {}
+        self._signatures = {}
+
+    @property
+    def gray(self) -> np.ndarray:
+        """ grayscale copy of the frame, converted once and shared by every lookup """
+        if self._gray is None:
+            self._gray = self.image if self.image.ndim == 2 else cv2.cvtColor(self.image, cv2.COLOR_BGR2GRAY)
+        return self._gray
+
+    def pyramid(self, level: int) -> np.ndarray:
+        """
+        grayscale frame downsampled 'level' times by half, cached
+        """
+        if level == 0:
+            return self.gray
+        if level not in self._levels:
+            self._levels[level] = cv2.pyrDown(self.pyramid(level - 1))
+        return self._levels[level]
+
+    def window_std(self, left: int, top: int, width: int, height: int) -> float:
+        """
+        standard deviation of a frame window, only the template sized window is read
+        """
+        window = self.gray[top:top + height, left:left + width]
+        if window.size == 0:
+            return 0.0
+        _, std = cv2.meanStdDev(window)
+        return float(std[0][0])
+
+    def signature(self, region=None, size=(64, 36)) -> np.ndarray:
+        """
+        downsampled grayscale copy of a region, cheap to compare between frames to detect change
+        :param region: (x0, y0, x1, y1), None for the whole frame
+        :param size: (width, height) of the signature
+        """
+        key = (region, size)
+        if key not in self._signatures:
+            gray = self.gray if region is None else self.gray[region[1]:region[3], region[0]:region[2]]
+            size = (min(size[0], gray.shape[1]), min(size[1], gray.shape[0]))
+            self._signatures[key] = cv2.resize(gray, size, interpolation=cv2.INTER_AREA)
+        return self._signatures[key]
+
+    @property
+    def size(self):
+        height, width = self.image.shape[:2]
+        return width, height
+
+
+class FrameSource:
+    """
+    Base class of everything that can produce Frames. Subclass and implement grab()
+    """
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.window = None  # Window to capture, None for the whole screen
+
+    def region(self):
+        """
+        :return: (left, top, width, height) of the window to capture, None for the whole screen
+        """
+        return None if self.window is None else self.window.rect()
+
+    def grab(self) -> Frame:
+        raise NotImplementedError
+
+    def _new_frame(self, image: np.ndarray, started: float = None, region=None) -> Frame:
+        """
+        :param started: time.perf_counter() before the capture, to time it
+        :param region: (left, top, width, height) that was captured
+        """
+        capture_ms = 0.0 if started is None else (time.perf_counter() - started) * 1000
+        origin = (0, 0) if region is None else tuple(region[:2])
+        frame = Frame(image, index=self.count, capture_ms=capture_ms, origin=origin)
+        self.count += 1
+        return frame
+
+
+class ScreenSource(FrameSource):
+    """
+    Capture the live screen, or only the window when one is set, with pyautogui
+    """
+
+    def grab(self) -> Frame:
+        import pyautogui  # needs a display, only import when the live screen is used
+
+        region = self.region()
+        started = time.perf_counter()
+        image = np.array(pyautogui.screenshot(region=region))
+        return self._new_frame(cv2.cvtColor(image, cv2.COLOR_RGB2BGR), started, region)
+
+
+class RecordedSource(FrameSource):
+    def __init__(self, frames: Union[List[pathlib.PurePath], pathlib.PurePath, str], loop: bool = False) -> None:
+        """
+        Replay PNG frames recorded from the emulator, allows testing without a display
+        :param frames: folder of frames (sorted by name) or list of frame paths
+        :param loop: start over after last frame, else keep returning the last frame
+        """
+        super().__init__()
+        if isinstance(frames, (str, pathlib.PurePath)):
+            frames = sorted(x for x in Path(frames).iterdir() if x.suffix.lower() == ".png")
+        assert len(frames) != 0, "RecordedSource needs at least one frame"
+
+        self.paths = [Path(x) for x in frames]
+        self.loop = loop
+        self.pos = 0
+
+    def grab(self) -> Frame:
+        started = time.perf_counter()
+        image = cv2.imread(str(self.paths[self.pos]), cv2.IMREAD_COLOR)
+        assert image is not None, f"Unable to read frame {self.paths[self.pos]}"
+
+        if self.pos < len(self.paths) - 1:
+            self.pos += 1
+        elif self.loop:
+            self.pos = 0
+        return self._new_frame(image, started)
@@ -0,0 +1,131 @@
+import os
+import subprocess
+import time
+from typing import List, Tuple
+
+
+class InputBackend:
+    """
+    Base class of everything that can click on the emulator. Subclass and implement click() and drag()
+    """
+
+    def click(self, x: int, y: int, hold: float = 0.5):
+        raise NotImplementedError
+
+    def drag(self, x0: int, y0: int, x1: int, y1: int, duration: float = 0.5):
+        """
+        press at (x0, y0), move to (x1, y1) in duration seconds and release, scrolls lists like the dock
+        """
+        raise NotImplementedError
+
+
+class Win32Input(InputBackend):
+    """
+    Click with win32 mouse events, the default on Windows
+    """
+
+    def click(self, x: int, y: int, hold: float = 0.5):
+        import win32api  # windows only, only import when clicks are sent
+        import win32con
+
+        win32api.SetCursorPos((x, y))
+        win32api.mouse_event(win32con.MOUSEEVENTF_LEFTDOWN, 0, 0)
+        time.sleep(hold)
+        win32api.mouse_event(win32con.MOUSEEVENTF_LEFTUP, 0, 0)
+
+    def drag(self, x0: int, y0: int, x1: int, y1: int, duration: float = 0.5):
+        import win32api
+        import win32con
+
+        steps = 10
+        win32api.SetCursorPos((x0, y0))
+        win32api.mouse_event(win32con.MOUSEEVENTF_LEFTDOWN, 0, 0)
+        for step in range(1, steps + 1):
+            time.sleep(duration / steps)
+            win32api.SetCursorPos((x0 + (x1 - x0) * step // steps, y0 + (y1 - y0) * step // steps))
+        win32api.mouse_event(win32con.MOUSEEVENTF_LEFTUP, 0, 0)
+
+
+class PyAutoGuiInput(InputBackend):
+    """
+    Click with pyautogui, works wherever pyautogui has a display
+    """
+
+    def click(self, x: int, y: int, hold: float = 0.5):
+        import pyautogui
+
+        pyautogui.mouseDown(x=x, y=y)
+        time.sleep(hold)
+        pyautogui.mouseUp(x=x, y=y)
+
+    def drag(self, x0: int, y0: int, x1: int, y1: int, duration: float = 0.5):
+        import pyautogui
+
+        pyautogui.moveTo(x0, y0)
+        pyautogui.dragTo(x1, y1, duration=duration, button="left")
+
+
+class AdbInput(InputBackend):
+    def __init__(self, serial: str = None, adb: str = "adb") -> None:
+        """
+        Tap through 'adb shell input', coordinates are device pixels so use it together with AdbSource
+        :param serial: device serial, e.g. '127.0.0.1:5555' for BlueStacks, None for the only connected device
+        :param adb: adb executable
+        """
+        self.command = [adb] if serial is None else [adb, "-s", serial]
+
+    def click(self, x: int, y: int, hold: float = 0.5):
+        # a swipe that does not move is a tap held for the swipe duration
+        subprocess.run(self.command + ["shell", "input", "swipe", str(x), str(y), str(x), str(y),
+                                       str(int(hold * 1000))], check=True, capture_output=True)
+
+    def drag(self, x0: int, y0: int, x1: int, y1: int, duration: float = 0.5):
+        subprocess.run(self.command + ["shell", "input", "swipe", str(x0), str(y0), str(x1), str(y1),
+                                       str(int(duration * 1000))], check=True, capture_output=True)
+
+
+class NullInput(InputBackend):
+    """
+    Drop every click, e.g. to watch what pybot would do without touching the game
+    """
+
+    def click(self, x: int, y: int, hold: float = 0.5):
+        pass
+
+    def drag(self, x0: int, y0: int, x1: int, y1: int, duration: float = 0.5):
+        pass
+
+
+class FakeInput(InputBackend):
+    def __init__(self, source=None) -> None:
+        """
+        Record clicks instead of sending them, for running headless against recordings
+        :param source: ReplaySource moved to the frames recorded after the same click or drag
+        """
+        self.source = source
+        self.clicks: List[Tuple[int, int, float]] = []  # (x, y, time)
+        self.drags: List[Tuple[int, int, int, int, float]] = []  # (x0, y0, x1, y1, time)
+
+    def click(self, x: int, y: int, hold: float = 0.5):
+        self.clicks.append((x, y, time.time()))
+        if self.source is not None:
+            self.source.advance()
+
+    def drag(self, x0: int, y0: int, x1: int, y1: int, duration: float = 0.5):
+        self.drags.append((x0, y0, x1, y1, time.time()))
+        if self.source is not None:
+            self.source.advance()
+
+
+INPUT_BACKENDS = {"win32": Win32Input, "pyautogui": PyAutoGuiInput, "adb": AdbInput, "null": NullInput}
+
+
+def input_backend(name: str = "auto", serial: str = None) -> InputBackend:
+    """
+    :param name: key of INPUT_BACKENDS, 'auto' picks win32 on Windows else pyautogui
+    :param serial: device serial for adb
+    """
+    if name == "auto":
+        name = "win32" if os.name == "nt" else "pyautogui"
+    assert name in INPUT_BACKENDS, f"Unknown input backend {name}, choose from {sorted(INPUT_BACKENDS)}"
+    return AdbInput(serial) if name == "adb" else INPUT_BACKENDS[name]()
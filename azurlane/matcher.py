@@ -0,0 +1,222 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Union, List, Dict, NamedTuple, Tuple, Set
+
+import cv2
+import numpy as np
+
+from azurlane.frame import Frame
+from azurlane.metrics import Metrics
+from azurlane.roi import RoiTracker
+from azurlane.templates import Template, TemplateCache
+
+
+class Match(NamedTuple):
+    name: str
+    confidence: float
+    left: int = 0
+    top: int = 0
+    width: int = 0
+    height: int = 0
+    threshold: float = 0.8
+
+    @property
+    def hit(self) -> bool:
+        return self.confidence >= self.threshold
+
+    @property
+    def box(self):
+        return self.left, self.top, self.width, self.height
+
+
+class MultiMatcher:
+    def __init__(self,
+                 templates: TemplateCache,
+                 scale: float = 1.0,
+                 workers: int = 0,
+                 levels: int = 1,
+                 min_size: int = 12,
+                 coarse_margin: float = 0.25,
+                 roi: RoiTracker = None,
+                 static_threshold: int = 4,
+                 static_max_age: float = 2.0,
+                 metrics: Metrics = None) -> None:
+        """
+        Match many templates against one frame in a single call.
+        Grayscale and pyramid levels of the frame are computed once and shared by every template. Each template
+        is located on the downsampled pyramid level first, and only a small window around the coarse hit is
+        searched at full resolution.
+        :param templates: template cache
+        :param scale: scale of the image set to use
+        :param workers: spread matchTemplate calls over a thread pool (opencv releases the GIL), 0 runs inline
+        :param levels: number of pyramid levels used for the coarse search, 0 disables it
+        :param min_size: smallest template side allowed on the coarse level, smaller templates scan full frame
+        :param coarse_margin: coarse scores below (threshold - coarse_margin) are rejected without a full scan
+        :param roi: search a padded window around the last hit first, full frame only on a miss
+        :param static_threshold: reuse the previous result of a template when no pixel of the downsampled region
+                                 it was decided in changed by more than this, 0 disables change detection. The
+                                 region is downsampled to cells of about a quarter of the template size
+        :param static_max_age: seconds a result is reused at most, a change below static_threshold (e.g. a small
+                               button on a large desktop capture) is searched again after it
+        :param metrics: records confidence, hit and latency of every lookup
+        """
+        self.templates = templates
+        self.scale = scale
+        self.levels = levels
+        self.min_size = min_size
+        self.coarse_margin = coarse_margin
+        self.roi = roi
+        self.static_threshold = static_threshold
+        self.static_max_age = static_max_age
+        self.metrics = metrics
+        # name: (region, signature, threshold, match, gray, time.perf_counter() searched) of the previous lookup
+        self.last: Dict[str, Tuple] = {}
+        self.matched = 0
+        self.skipped = 0
+        self.deferred: Set[str] = set()  # names of the last match() whose miss was not searched on the full frame
+        self.pool = ThreadPoolExecutor(max_workers=workers) if workers > 1 else None
+
+    def match(self,
+              frame: Frame,
+              names: Union[List[str], Dict[str, float]],
+              confidence: float = 0.8,
+              polling: bool = False) -> Dict[str, Match]:
+        """
+        :param frame: frame to search in
+        :param names: template names, or {name: threshold} to override confidence per template
+        :param confidence: default threshold
+        :param polling: the caller matches again on the next frame, a ROI miss only falls back to a full frame
+                        scan every RoiTracker.full_interval. One off lookups always scan the full frame on a miss
+        :return: {name: Match} for every requested name, check Match.hit
+        """
+        thresholds = names if isinstance(names, dict) else {name: confidence for name in names}
+        self.deferred = set()
+
+        if self.pool is not None:
+            # shared per frame work, computed before fanning out so threads do not race on it
+            frame.gray
+            for level in range(1, self.levels + 1):
+                frame.pyramid(level)
+
+        jobs = [(self.templates.get(name, self.scale), threshold) for name, threshold in thresholds.items()]
+        if self.pool is None:
+            results = [self._match_one(frame, template, threshold, polling) for template, threshold in jobs]
+        else:
+            results = list(self.pool.map(lambda job: self._match_one(frame, *job, polling), jobs))
+        return {m.name: m for m in results}
+
+    def _match_one(self, frame: Frame, template: Template, threshold: float, polling: bool = False) -> Match:
+        if self.static_threshold > 0:
+            last = self.last.get(template.name)
+            if last is not None and last[2] == threshold and last[4] is template.gray and \
+                    time.perf_counter() - last[5] < self.static_max_age:
+                region, signature, _, match, _, _ = last
+                if not changed(signature, self._signature(frame, region, template), self.static_threshold):
+                    self.skipped += 1
+                    self._record(frame, match, 0.0)
+                    return match
+
+        started = time.perf_counter()
+        match, region = self._search(frame, template, threshold, polling)
+        self.matched += 1
+        if self.static_threshold > 0 and region is False:
+            self.last.pop(template.name, None)  # the frame was not fully searched, a later lookup has to
+        elif self.static_threshold > 0:
+            self.last[template.name] = (region, self._signature(frame, region, template), threshold, match,
+                                        template.gray, started)
+        self._record(frame, match, (time.perf_counter() - started) * 1000)
+        return match
+
+    @staticmethod
+    def _signature(frame: Frame, region, template: Template) -> np.ndarray:
+        """
+        signature of the region a template was decided in, with cells of about a quarter of the template so a
+        button showing up changes whole cells instead of being averaged away on a large frame
+        """
+        x0, y0, x1, y1 = (0, 0) + frame.size if region is None else region
+        cell = max(min(template.shape) // 4, 1)
+        cell = 1 << (cell.bit_length() - 1)  # powers of two, templates of similar size share a signature
+        return frame.signature(region, (max((x1 - x0) // cell, 64), max((y1 - y0) // cell, 36)))
+
+    def _record(self, frame: Frame, match: Match, match_ms: float):
+        if self.metrics is not None:
+            self.metrics.lookup(match.name, self.scale, match.confidence, match.hit, frame.capture_ms, match_ms)
+
+    def _search(self, frame: Frame, template: Template, threshold: float, polling: bool = False):
+        """
+        :return: Match and the region that decided it, (x0, y0, x1, y1) for a ROI hit, None for the full frame,
+                 False for a ROI miss whose full frame scan was deferred
+        """
+        if self.roi is None:
+            return self._match_full(frame, template, threshold), None
+
+        window = self.roi.window(template.name, frame.size, template.shape)
+        if window is not None:
+            x0, y0, x1, y1 = window
+            confidence, (left, top, _, _) = template.match(frame.gray[y0:y1, x0:x1])
+            match = self._verify(frame, template, confidence, left + x0, top + y0, threshold)
+            if match.hit:
+                self.roi.update(template.name, match.box, from_roi=True)
+                return match, window
+            if polling and not self.roi.full_due(template.name):
+                self.roi.update(template.name, None, from_roi=True)
+                self.deferred.add(template.name)
+                return match, False
+
+        match = self._match_full(frame, template, threshold)
+        self.roi.update(template.name, match.box if match.hit else None, from_roi=False)
+        return match, None
+
+    def _match_full(self, frame: Frame, template: Template, threshold: float) -> Match:
+        height, width = template.shape
+        level = self._coarse_level(template)
+
+        if level == 0:
+            confidence, (left, top, _, _) = template.match(frame.gray)
+        else:
+            coarse_conf, (left, top, _, _) = template.level(level).match(frame.pyramid(level))
+            if coarse_conf < threshold - self.coarse_margin:
+                return Match(template.name, coarse_conf, threshold=threshold)
+
+            # refine in a window around the coarse hit at full resolution
+            factor = 2 ** level
+            pad = factor * 2
+            x0, y0 = max(left * factor - pad, 0), max(top * factor - pad, 0)
+            x1 = min(left * factor + width + pad, frame.gray.shape[1])
+            y1 = min(top * factor + height + pad, frame.gray.shape[0])
+            confidence, (left, top, _, _) = template.match(frame.gray[y0:y1, x0:x1])
+            left, top = left + x0, top + y0
+
+        return self._verify(frame, template, confidence, left, top, threshold)
+
+    @staticmethod
+    def _verify(frame: Frame, template: Template, confidence: float, left: int, top: int, threshold: float):
+        height, width = template.shape
+        # flat screen areas give unstable correlation scores, reject when template has texture but window has none
+        if template.std > 1.0 and frame.window_std(left, top, width, height) < 1.0:
+            confidence = 0.0
+        return Match(template.name, confidence, left, top, width, height, threshold)
+
+    def _coarse_level(self, template: Template) -> int:
+        level = self.levels
+        while level > 0 and min(template.shape) // (2 ** level) < self.min_size:
+            level -= 1
+        return level
+
+    def reset(self):
+        """
+        forget previous results, next lookup of every template runs a search
+        """
+        self.last = {}
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+
+
+def changed(previous: np.ndarray, current: np.ndarray, threshold: int) -> bool:
+    """
+    compare two frame signatures
+    :return: True when any pixel differs by more than threshold
+    """
+    return previous.shape != current.shape or int(cv2.absdiff(previous, current).max()) > threshold
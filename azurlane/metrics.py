@@ -0,0 +1,202 @@
+"""
+Per-action telemetry of the bot. Summarize a recorded file with
+    python -m azurlane.metrics ./log/metrics.jsonl
+"""
+import argparse
+import csv
+import json
+import pathlib
+import threading
+import time
+from collections import deque
+from pathlib import Path
+from typing import Union, Dict, List, NamedTuple, Optional
+
+import numpy as np
+
+
+class Event(NamedTuple):
+    time: float
+    kind: str  # 'lookup', 'click', 'state' or 'loop'
+    name: str = ""
+    scale: float = 0.0
+    confidence: float = 0.0
+    hit: bool = False
+    capture_ms: float = 0.0  # time the frame took to capture
+    match_ms: float = 0.0  # time the lookup took, 0 when the previous result was reused
+    next_ms: float = -1.0  # click to next state, -1 when unknown
+
+
+class Metrics:
+    def __init__(self,
+                 path: Union[pathlib.PurePath, str] = None,
+                 capacity: int = 10000,
+                 flush_interval: float = 30.0) -> None:
+        """
+        Record every template lookup, click and state change in ring buffers and append them to a JSONL or CSV
+        file (by suffix) every flush_interval seconds.
+        :param path: file events are appended to, None keeps them in memory only
+        :param capacity: max events held between flushes and max latencies held per template, oldest are dropped
+        :param flush_interval: seconds between flushes
+        """
+        self.path = None if path is None else Path(path)
+        self.capacity = capacity
+        self.flush_interval = flush_interval
+        self.events = deque(maxlen=capacity)
+        self.latency: Dict[str, deque] = {}  # match_ms of searched lookups per template
+        self.hits: Dict[str, List[int]] = {}  # [hits, misses] per template
+        self.loops = 0
+        self.started = time.time()
+        self.pending: Optional[Event] = None  # last click, waiting for the next state
+        self.dropped = 0
+        self.flushed_at = time.time()
+        self.lock = threading.Lock()
+
+    def lookup(self, name: str, scale: float, confidence: float, hit: bool, capture_ms: float, match_ms: float):
+        """
+        :param match_ms: 0 when the lookup reused a previous result
+        """
+        with self.lock:  # lookups can come from the matcher thread pool
+            if match_ms > 0:
+                self.latency.setdefault(name, deque(maxlen=self.capacity)).append(match_ms)
+            self.hits.setdefault(name, [0, 0])[0 if hit else 1] += 1
+        self._add(Event(time.time(), "lookup", name, scale, round(confidence, 4), hit, round(capture_ms, 3),
+                        round(match_ms, 3)))
+
+    def click(self, name: str, scale: float = 0.0, confidence: float = 0.0):
+        """
+        the click is written once the next state shows up (or the next click happens) with the time it took
+        """
+        with self.lock:
+            pending, self.pending = self.pending, Event(time.time(), "click", name, scale, round(confidence, 4),
+                                                        True)
+        if pending is not None:
+            self._add(pending)
+
+    def state(self, name: str):
+        """
+        a screen/template the bot waited for showed up
+        """
+        now = time.time()
+        with self.lock:
+            pending, self.pending = self.pending, None
+        if pending is not None:
+            self._add(pending._replace(next_ms=round((now - pending.time) * 1000, 3)))
+        self._add(Event(now, "state", name))
+
+    def loop(self):
+        self.loops += 1
+        self._add(Event(time.time(), "loop"))
+
+    def _add(self, event: Event):
+        if len(self.events) == self.capacity:
+            self.dropped += 1
+        self.events.append(event)
+        if self.path is not None and event.time - self.flushed_at >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """
+        append buffered events to the file
+        """
+        with self.lock:
+            self.flushed_at = time.time()
+            events = [self.events.popleft() for _ in range(len(self.events))]
+        if self.path is None or len(events) == 0:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        if self.path.suffix.lower() == ".csv":
+            new = not self.path.is_file()
+            with open(self.path, "a", newline="") as f:
+                writer = csv.writer(f)
+                if new:
+                    writer.writerow(Event._fields)
+                writer.writerows(events)
+        else:
+            with open(self.path, "a") as f:
+                f.writelines(json.dumps(event._asdict()) + "\n" for event in events)
+
+    def summary(self) -> Dict[str, Dict]:
+        """
+        :return: {name: {lookups, hit_rate, p50_ms, p95_ms}} of the templates looked up since start
+        """
+        return summarize_latency(self.latency, self.hits)
+
+    def loops_per_hour(self) -> float:
+        return loops_per_hour(self.loops, time.time() - self.started)
+
+    def report(self, log):
+        """
+        log the slowest templates first
+        """
+        for name, stats in self.summary().items():
+            log.info(f"Match {name}: {format_stats(stats)}")
+        log.info(f"Metrics: {self.loops_per_hour():.1f} loops/hour, {self.dropped} events dropped before flush")
+
+
+def summarize_latency(latency: Dict[str, List[float]], hits: Dict[str, List[int]]) -> Dict[str, Dict]:
+    result = {}
+    for name, (hit, miss) in hits.items():
+        values = np.asarray(latency.get(name, ()), dtype=np.float64)
+        result[name] = {
+            "lookups": hit + miss,
+            "hit_rate": hit / max(hit + miss, 1),
+            "p50_ms": float(np.percentile(values, 50)) if values.size else 0.0,
+            "p95_ms": float(np.percentile(values, 95)) if values.size else 0.0,
+        }
+    return dict(sorted(result.items(), key=lambda item: item[1]["p95_ms"], reverse=True))
+
+
+def loops_per_hour(loops: int, seconds: float) -> float:
+    return loops / seconds * 3600 if seconds > 0 else 0.0
+
+
+def format_stats(stats: Dict) -> str:
+    return f"lookups={stats['lookups']} hit={stats['hit_rate'] * 100:.0f}% " \
+           f"p50={stats['p50_ms']:.2f}ms p95={stats['p95_ms']:.2f}ms"
+
+
+def load(path: Union[pathlib.PurePath, str]) -> List[Event]:
+    """
+    read events written by Metrics.flush
+    """
+    path = Path(path)
+    with open(path, newline="") as f:
+        if path.suffix.lower() == ".csv":
+            rows = list(csv.DictReader(f))
+        else:
+            rows = [json.loads(line) for line in f if line.strip()]
+    return [Event(float(row["time"]), row["kind"], row["name"], float(row["scale"]), float(row["confidence"]),
+                  row["hit"] in (True, "True"), float(row["capture_ms"]), float(row["match_ms"]),
+                  float(row["next_ms"])) for row in rows]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize pybot metrics")
+    parser.add_argument("path", type=Path, help="jsonl or csv file written by Metrics")
+    args = parser.parse_args()
+
+    events = load(args.path)
+    latency, hits, clicks = {}, {}, {}
+    for event in events:
+        if event.kind == "lookup":
+            if event.match_ms > 0:
+                latency.setdefault(event.name, []).append(event.match_ms)
+            hits.setdefault(event.name, [0, 0])[0 if event.hit else 1] += 1
+        elif event.kind == "click" and event.next_ms >= 0:
+            clicks.setdefault(event.name, []).append(event.next_ms)
+
+    loops = sum(1 for event in events if event.kind == "loop")
+    seconds = events[-1].time - events[0].time if events else 0.0
+    print(f"{len(events)} events over {seconds / 3600:.2f}h, {loops_per_hour(loops, seconds):.1f} loops/hour")
+    print("match latency, slowest first")
+    for name, stats in summarize_latency(latency, hits).items():
+        print(f"{name:>24} : {format_stats(stats)}")
+    print("click to next state")
+    for name, values in sorted(clicks.items()):
+        print(f"{name:>24} : clicks={len(values)} p50={np.percentile(values, 50):.0f}ms "
+              f"p95={np.percentile(values, 95):.0f}ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,165 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+from azurlane.al_stage import Stage
+from azurlane.capture import MssSource
+from azurlane.frame import Frame, FrameSource
+from azurlane.inputs import InputBackend
+from azurlane.window import Window
+
+
+class SharedCapture:
+    def __init__(self, source: FrameSource, max_age: float = 0.05) -> None:
+        """
+        One desktop capture per tick shared by every instance, a frame younger than max_age is handed out again
+        unless it was captured before the last click of the instance asking for it. With mss each monitor is
+        captured on its own, an instance gets the monitor its window is on.
+        :param source: full desktop source
+        :param max_age: seconds a capture is reused
+        """
+        self.source = source
+        self.max_age = max_age
+        self.frames = {}  # {mss monitor or None: (frame, time.perf_counter() its capture started at)}
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def grab(self, region=None, after: float = 0.0) -> Frame:
+        """
+        :param region: (left, top, width, height) the caller cuts out of the frame
+        :param after: only hand out a capture started at or after this time.perf_counter(), e.g. the end of the
+                      last click of the caller
+        """
+        monitor = None
+        if region is not None and isinstance(self.source, MssSource):
+            monitor = self.source.monitor_for(region)
+        with self.lock:
+            self.requests += 1
+            frame, started = self.frames.get(monitor, (None, 0.0))
+            if frame is None or started < after or time.perf_counter() - started >= self.max_age:
+                started = time.perf_counter()
+                frame = self.source.grab() if monitor is None else self.source.grab_monitor(monitor)
+                self.frames[monitor] = (frame, started)
+            return frame
+
+    def __repr__(self):
+        return f"captures={self.source.count} requests={self.requests} " \
+               f"shared={1 - self.source.count / max(self.requests, 1):.0%}"
+
+
+class RegionSource(FrameSource):
+    def __init__(self, capture: SharedCapture, window: Window) -> None:
+        """
+        Frames of one instance, cut from the shared desktop capture
+        """
+        super().__init__()
+        self.capture = capture
+        self.window = window
+        self.acted_at = 0.0  # time.perf_counter() the last click or drag of this instance ended, set by SerialInput
+
+    def grab(self) -> Frame:
+        region = self.region()
+        desktop = self.capture.grab(region, after=self.acted_at)
+        left, top, width, height = region
+        left, top = left - desktop.origin[0], top - desktop.origin[1]
+        frame = self._new_frame(desktop.image[top:top + height, left:left + width], region=region)
+        frame.capture_ms = desktop.capture_ms
+        frame.timestamp = desktop.timestamp
+        return frame
+
+
+class SerialInput(InputBackend):
+    def __init__(self, backend: InputBackend, source: RegionSource, lock: threading.Lock) -> None:
+        """
+        Click one instance through a mouse shared by every instance, one click at a time
+        :param backend: input backend in screen pixels
+        :param source: frames of the instance, its window makes clicks relative and it skips captures taken
+                       before the click ended
+        :param lock: shared by the inputs of every instance
+        """
+        self.backend = backend
+        self.source = source
+        self.window = source.window
+        self.lock = lock
+        self.clicks = 0
+        self.waited = 0.0
+        self.max_wait = 0.0
+
+    def click(self, x: int, y: int, hold: float = 0.5):
+        started = time.perf_counter()
+        with self.lock:
+            wait = time.perf_counter() - started
+            self.clicks += 1
+            self.waited += wait
+            self.max_wait = max(self.max_wait, wait)
+            left, top = self.window.origin
+            self.backend.click(x + left, y + top, hold)
+            self.source.acted_at = time.perf_counter()
+
+    def drag(self, x0: int, y0: int, x1: int, y1: int, duration: float = 0.5):
+        with self.lock:
+            left, top = self.window.origin
+            self.backend.drag(x0 + left, y0 + top, x1 + left, y1 + top, duration)
+            self.source.acted_at = time.perf_counter()
+
+    def __repr__(self):
+        return f"clicks={self.clicks} mouse wait total={self.waited:.2f}s " \
+               f"mean={self.waited / max(self.clicks, 1) * 1000:.0f}ms max={self.max_wait * 1000:.0f}ms"
+
+
+class Instance:
+    def __init__(self, name: str, stage: Stage, source: RegionSource, backend: SerialInput) -> None:
+        """
+        One emulator driven by its own Stage, template cache and window
+        """
+        self.name = name
+        self.stage = stage
+        self.source = source
+        self.backend = backend
+
+
+class Orchestrator:
+    def __init__(self, capture: SharedCapture, log: logging) -> None:
+        """
+        Run the Stage of several emulator instances side by side, one worker thread per instance. Frames come
+        from one shared desktop capture per tick and clicks are serialized through one mouse lock.
+        """
+        self.capture = capture
+        self.log = log
+        self.instances: List[Instance] = []
+        self.mouse = threading.Lock()
+
+    def source(self, window: Window) -> RegionSource:
+        return RegionSource(self.capture, window)
+
+    def input(self, backend: InputBackend, source: RegionSource) -> SerialInput:
+        return SerialInput(backend, source, self.mouse)
+
+    def add(self, instance: Instance):
+        self.instances.append(instance)
+
+    def run(self, listener):
+        """
+        run every instance until the listener stops
+        """
+        def loop(instance: Instance):
+            try:
+                while listener.running:
+                    instance.stage.run(listener)
+            except Exception:
+                self.log.exception(f"Instance {instance.name} stopped")
+
+        with ThreadPoolExecutor(max_workers=len(self.instances), thread_name_prefix="instance") as pool:
+            for instance in self.instances:
+                pool.submit(loop, instance)
+
+    def report(self):
+        """
+        log throughput and mouse wait of every instance
+        """
+        self.log.info(f"Shared capture: {self.capture}")
+        for instance in self.instances:
+            self.log.info(f"Instance {instance.name}: {instance.stage.loops} loops, "
+                          f"{instance.stage.loops_per_hour():.1f} loops/hour, {instance.backend}")
@@ -0,0 +1,202 @@
+import queue
+import threading
+import time
+from typing import Optional
+
+from azurlane.frame import Frame, FrameSource
+from azurlane.inputs import InputBackend
+
+
+class LatestFrame:
+    def __init__(self) -> None:
+        """
+        Single slot buffer between the capture thread and the matcher, a new frame replaces the one not taken yet
+        """
+        self.cond = threading.Condition()
+        self.frame = None
+        self.started = 0.0  # time.perf_counter() the frame capture started at
+        self.taken = True
+        self.dropped = 0  # frames replaced before they were taken
+
+    def put(self, frame: Frame, started: float):
+        with self.cond:
+            if not self.taken:
+                self.dropped += 1
+            self.frame, self.started, self.taken = frame, started, False
+            self.cond.notify_all()
+
+    def take(self, after: float, timeout: float) -> Optional[Frame]:
+        """
+        :param after: only accept a frame whose capture started at or after this time.perf_counter()
+        :param timeout: seconds to wait for one
+        :return: newest frame not taken before, None on timeout
+        """
+        deadline = time.perf_counter() + timeout
+        with self.cond:
+            while self.taken or self.started < after:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    return None
+                self.cond.wait(remaining)
+            self.taken = True
+            return self.frame
+
+    def wake(self):
+        with self.cond:
+            self.cond.notify_all()
+
+
+class PipelinedSource(FrameSource):
+    def __init__(self, source: FrameSource, interval: float = 0.005, poll: float = 0.1) -> None:
+        """
+        Capture on a background thread so matching never waits for a screenshot. grab() hands out the latest
+        frame it did not hand out before, frames captured before a click queued on PipelinedInput finished are
+        skipped. Until start() it captures inline like the wrapped source.
+        :param source: source captured from
+        :param interval: min seconds between two captures, keeps replays and null capture from spinning
+        :param poll: seconds between checks of the stop flag while grab() waits for a frame
+        """
+        super().__init__()
+        self.source = source
+        self.window = source.window
+        self.interval = interval
+        self.poll = poll
+        self.buffer = LatestFrame()
+        self.lock = threading.Lock()  # captures and actions do not overlap, a replay advances on clicks
+        self.listener = None
+        self.stopped = threading.Event()
+        self.thread = None
+        self.error = None
+
+        self.pending = 0  # actions queued and not finished yet
+        self.after = 0.0  # capture start frames must have, the end of the last action
+        self.captured = 0
+        self.stale = 0  # frames captured while an action was pending
+
+    def start(self, listener=None):
+        """
+        :param listener: keyboard listener (or ReplaySource), capture stops once it is not running
+        """
+        self.listener = listener
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self._capture, name="capture", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.buffer.wake()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def running(self) -> bool:
+        return not self.stopped.is_set() and (self.listener is None or self.listener.running)
+
+    def hold(self):
+        """
+        an action was queued, frames captured from now until release() show the screen before it
+        """
+        with self.buffer.cond:
+            self.pending += 1
+            self.after = float("inf")
+
+    def release(self):
+        with self.buffer.cond:
+            self.pending -= 1
+            if self.pending == 0:
+                self.after = time.perf_counter()
+            self.buffer.cond.notify_all()
+
+    def grab(self) -> Frame:
+        if self.thread is None:
+            with self.lock:
+                frame = self.source.grab()
+            self.count += 1
+            return frame
+
+        while True:
+            frame = self.buffer.take(self.after, self.poll)
+            if self.error is not None:
+                raise self.error
+            if frame is not None:
+                self.count += 1
+                return frame
+            if not self.running():
+                # nothing new will come, hand out the last frame so the caller sees the stop flag
+                self.count += 1
+                return self.buffer.frame if self.buffer.frame is not None else self.source.grab()
+
+    def _capture(self):
+        try:
+            while self.running():
+                started = time.perf_counter()
+                with self.lock:
+                    frame = self.source.grab()
+                self.captured += 1
+                if started < self.after:
+                    self.stale += 1
+                else:
+                    self.buffer.put(frame, started)
+                self.stopped.wait(max(self.interval - (time.perf_counter() - started), 0))
+        except Exception as e:
+            self.error = e
+        self.buffer.wake()
+
+    def __repr__(self):
+        return f"captured={self.captured} used={self.count} dropped={self.buffer.dropped} " \
+               f"skipped during actions={self.stale}"
+
+
+class PipelinedInput(InputBackend):
+    def __init__(self, backend: InputBackend, source: PipelinedSource) -> None:
+        """
+        Send clicks and drags from an actor thread so the caller goes on matching, the source skips the frames
+        captured before they are done
+        :param backend: input backend the actions are sent with
+        :param source: pipelined source of the same emulator
+        """
+        self.backend = backend
+        self.source = source
+        self.actions = queue.Queue()
+        self.sent = 0
+        self.dropped = 0  # actions queued when the listener stopped
+        self.delay = 0.0  # total seconds actions waited in the queue
+        self.thread = threading.Thread(target=self._act, name="actor", daemon=True)
+        self.thread.start()
+
+    def click(self, x: int, y: int, hold: float = 0.5):
+        self._put(self.backend.click, x, y, hold)
+
+    def drag(self, x0: int, y0: int, x1: int, y1: int, duration: float = 0.5):
+        self._put(self.backend.drag, x0, y0, x1, y1, duration)
+
+    def stop(self):
+        self.actions.put(None)
+        self.thread.join()
+
+    def _put(self, action, *params):
+        self.source.hold()
+        self.actions.put((action, params, time.perf_counter()))
+
+    def _act(self):
+        while True:
+            item = self.actions.get()
+            if item is None:
+                return
+            action, params, queued = item
+            try:
+                if self.source.listener is not None and not self.source.listener.running:
+                    self.dropped += 1
+                    continue
+                with self.source.lock:
+                    self.delay += time.perf_counter() - queued
+                    action(*params)
+                self.sent += 1
+            except Exception as e:
+                self.source.error = e  # raised by the next grab() of the matching thread
+            finally:
+                self.source.release()
+
+    def __repr__(self):
+        return f"actions={self.sent} dropped={self.dropped} " \
+               f"mean queue wait={self.delay / max(self.sent, 1) * 1000:.1f}ms"
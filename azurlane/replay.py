@@ -0,0 +1,132 @@
+import json
+import pathlib
+import time
+import zipfile
+from pathlib import Path
+from typing import Union, List, Dict
+
+import cv2
+import numpy as np
+
+from azurlane.frame import Frame, FrameSource
+from azurlane.inputs import InputBackend
+from azurlane.matcher import changed
+
+INDEX = "index.json"
+
+
+class RecordingSource(FrameSource):
+    def __init__(self,
+                 source: FrameSource,
+                 path: Union[pathlib.PurePath, str],
+                 static_threshold: int = 4) -> None:
+        """
+        Pass frames of another source through and save them, with the clicks sent in between (see RecordingInput),
+        to a zip archive. Frames that did not change since the last saved one are stored as a reference only.
+        :param source: source that captures the frames
+        :param path: archive written, the index is written by close()
+        :param static_threshold: frames whose signature differs by no more than this are not saved again
+        """
+        super().__init__()
+        self.source = source
+        self.window = source.window
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.static_threshold = static_threshold
+        self.archive = zipfile.ZipFile(self.path, "w", zipfile.ZIP_STORED)  # png is compressed already
+        self.frames: List[Dict] = []
+        self.actions: List[Dict] = []
+        self.stored = 0
+        self.last = None  # signature of the last stored image
+
+    def grab(self) -> Frame:
+        frame = self.source.grab()
+        signature = frame.signature()
+        if self.last is None or changed(self.last, signature, self.static_threshold):
+            self.archive.writestr(f"frames/{self.stored:06d}.png", cv2.imencode(".png", frame.image)[1].tobytes())
+            self.stored += 1
+            self.last = signature
+        self.frames.append({"image": self.stored - 1, "time": frame.timestamp, "capture_ms": frame.capture_ms,
+                            "actions": len(self.actions)})
+        self.count += 1
+        return frame
+
+    def action(self, x: int, y: int, hold: float):
+        self.actions.append({"x": x, "y": y, "hold": hold, "time": time.time(), "frame": len(self.frames) - 1})
+
+    def close(self):
+        index = {"frames": self.frames, "actions": self.actions, "images": self.stored}
+        self.archive.writestr(INDEX, json.dumps(index))
+        self.archive.close()
+
+
+class RecordingInput(InputBackend):
+    def __init__(self, backend: InputBackend, recording: RecordingSource) -> None:
+        """
+        Send clicks to backend and note them in the recording
+        """
+        self.backend = backend
+        self.recording = recording
+
+    def click(self, x: int, y: int, hold: float = 0.5):
+        self.recording.action(x, y, hold)
+        self.backend.click(x, y, hold)
+
+    def drag(self, x0: int, y0: int, x1: int, y1: int, duration: float = 0.5):
+        self.recording.action(x0, y0, duration)  # replays split segments on drags the same way as on clicks
+        self.backend.drag(x0, y0, x1, y1, duration)
+
+
+class ReplaySource(FrameSource):
+    def __init__(self, path: Union[pathlib.PurePath, str]) -> None:
+        """
+        Replay an archive written by RecordingSource. Frames are split into segments by the recorded clicks: grab()
+        steps through the frames of the current segment and keeps returning its last one, advance() (called by
+        FakeInput on every click) moves on to the frames recorded after the next click.
+        :param path: archive
+        """
+        super().__init__()
+        self.archive = zipfile.ZipFile(path, "r")
+        index = json.loads(self.archive.read(INDEX))
+        self.actions = index["actions"]
+        self.segments: List[List[Dict]] = [[] for _ in range(len(self.actions) + 1)]
+        for entry in index["frames"]:
+            self.segments[entry["actions"]].append(entry)
+        self.segments = [segment for segment in self.segments if segment]
+        assert len(self.segments) != 0, f"{path} has no frames"
+
+        self.images: Dict[int, np.ndarray] = {}  # decoded once, static frames share one image
+        self.segment = 0
+        self.pos = 0
+
+    @property
+    def done(self) -> bool:
+        """ True once the last frame of the last segment was returned """
+        return self.segment == len(self.segments) - 1 and self.pos == len(self.segments[-1])
+
+    @property
+    def running(self) -> bool:
+        """ same as the keyboard listener, Stage.run stops waiting once the recording is exhausted """
+        return not self.done
+
+    def grab(self) -> Frame:
+        segment = self.segments[self.segment]
+        entry = segment[min(self.pos, len(segment) - 1)]
+        self.pos = min(self.pos + 1, len(segment))
+        if entry["image"] not in self.images:
+            data = np.frombuffer(self.archive.read(f"frames/{entry['image']:06d}.png"), dtype=np.uint8)
+            self.images[entry["image"]] = cv2.imdecode(data, cv2.IMREAD_COLOR)
+        frame = self._new_frame(self.images[entry["image"]])
+        frame.capture_ms = entry["capture_ms"]
+        return frame
+
+    def advance(self):
+        if self.segment < len(self.segments) - 1:
+            self.segment += 1
+            self.pos = 0
+        else:
+            self.pos = len(self.segments[-1])
+
+    def rewind(self):
+        self.segment = 0
+        self.pos = 0
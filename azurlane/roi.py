@@ -0,0 +1,128 @@
+import time
+from typing import Dict, Tuple, Optional
+
+
+class Roi:
+    def __init__(self, hint: Tuple = None) -> None:
+        """
+        Search window and statistics of one template
+        :param hint: (left, top, width, height) where the button is expected. Values <= 1.0 are fractions of the
+                     frame size, else pixels
+        """
+        self.hint = hint
+        self.last = None  # (left, top, width, height) of last hit in pixels
+        self.lookups = 0
+        self.roi_hits = 0
+        self.full_hits = 0
+        self.misses = 0
+        self.deferred = 0  # window misses not followed by a full frame scan
+        self.scanned_at = 0.0  # time.perf_counter() of the last full frame scan after a window miss
+
+    def window(self, frame_size: Tuple[int, int], padding: int):
+        """
+        :return: (x0, y0, x1, y1) to search in or None when nothing is known about the template yet
+        """
+        box = self.last
+        if box is None and self.hint is not None:
+            frame_w, frame_h = frame_size
+            if all(v <= 1.0 for v in self.hint):
+                box = (self.hint[0] * frame_w, self.hint[1] * frame_h, self.hint[2] * frame_w, self.hint[3] * frame_h)
+            else:
+                box = self.hint
+        if box is None:
+            return None
+
+        left, top, width, height = (int(v) for v in box)
+        frame_w, frame_h = frame_size
+        return (max(left - padding, 0), max(top - padding, 0),
+                min(left + width + padding, frame_w), min(top + height + padding, frame_h))
+
+    def __repr__(self):
+        return f"lookups={self.lookups} roi_hits={self.roi_hits} full_hits={self.full_hits} misses={self.misses} " \
+               f"deferred={self.deferred}"
+
+
+class RoiTracker:
+    def __init__(self,
+                 hints: Dict[str, Tuple] = None,
+                 padding: float = 0.25,
+                 min_padding: int = 8,
+                 full_interval: float = 0.5) -> None:
+        """
+        Remember where each template was last found so the next lookup only searches a padded window around it.
+        Lookups fall back to a full frame scan when the window misses, while polling at most every full_interval.
+        :param hints: {name: (left, top, width, height)} expected location of templates never found yet
+        :param padding: window padding as a fraction of the template's longest side
+        :param min_padding: smallest padding in pixels
+        :param full_interval: min seconds between two full frame scans of a polled template whose window missed,
+                              0 scans after every miss
+        """
+        self.padding = padding
+        self.min_padding = min_padding
+        self.full_interval = full_interval
+        self.rois: Dict[str, Roi] = {}
+        for name, hint in (hints or {}).items():
+            self.rois[name] = Roi(hint)
+
+    def get(self, name: str) -> Roi:
+        if name not in self.rois:
+            self.rois[name] = Roi()
+        return self.rois[name]
+
+    def window(self, name: str, frame_size: Tuple[int, int], shape: Tuple[int, int]):
+        """
+        :param name: template name
+        :param frame_size: (width, height) of the frame
+        :param shape: (height, width) of the template
+        :return: (x0, y0, x1, y1) search window or None
+        """
+        padding = max(int(max(shape) * self.padding), self.min_padding)
+        window = self.get(name).window(frame_size, padding)
+        if window is None:
+            return None
+        x0, y0, x1, y1 = window
+        if x1 - x0 < shape[1] or y1 - y0 < shape[0]:
+            return None  # template does not fit, e.g. hint declared for another resolution
+        return window
+
+    def seed(self, name: str, coords: Tuple):
+        """
+        set a known location, e.g. coords captured by pybot.init_btn
+        """
+        self.get(name).last = tuple(int(v) for v in coords)
+
+    def full_due(self, name: str) -> bool:
+        """
+        a polled template whose window missed: buttons show up where they were seen before, so the rest of the
+        frame is only scanned every full_interval seconds
+        :return: True when the full frame scan runs now
+        """
+        roi = self.get(name)
+        now = time.perf_counter()
+        if now - roi.scanned_at < self.full_interval:
+            roi.deferred += 1
+            return False
+        roi.scanned_at = now
+        return True
+
+    def update(self, name: str, box: Optional[Tuple], from_roi: bool):
+        roi = self.get(name)
+        roi.lookups += 1
+        if box is None:
+            roi.misses += 1
+            return
+
+        roi.last = box
+        if from_roi:
+            roi.roi_hits += 1
+        else:
+            roi.full_hits += 1
+
+    def learned(self) -> Dict[str, Tuple]:
+        """
+        :return: {name: (left, top, width, height)} of the last hit of every template found so far
+        """
+        return {name: roi.last for name, roi in self.rois.items() if roi.last is not None}
+
+    def stats(self) -> Dict[str, Roi]:
+        return {name: roi for name, roi in self.rois.items() if roi.lookups > 0}
@@ -0,0 +1,89 @@
+import logging
+from typing import List, Dict, Tuple
+
+from azurlane.frame import Frame
+from azurlane.templates import TemplateCache
+
+
+class ScaleFinder:
+    def __init__(self,
+                 templates: TemplateCache,
+                 log: logging = None,
+                 min_scale: float = 0.25,
+                 max_scale: float = 1.0,
+                 coarse_step: float = 0.1,
+                 fine_step: float = 0.01) -> None:
+        """
+        Find the scale the GUI is drawn at with templates resized in memory.
+        A coarse sweep is scored on the half size pyramid level of the frame, then the best scale is refined at
+        full resolution with a step that halves until fine_step. Results are cached per window size.
+        :param templates: template cache, only originals (scale 1.0) are needed
+        :param log: logger
+        :param min_scale: smallest scale searched
+        :param max_scale: largest scale searched
+        :param coarse_step: step of the coarse sweep
+        :param fine_step: resolution of the result
+        """
+        self.templates = templates
+        self.log = log
+        self.min_scale = min_scale
+        self.max_scale = max_scale
+        self.coarse_step = coarse_step
+        self.fine_step = fine_step
+        self.calibrated: Dict[Tuple[int, int], float] = {}
+
+    def find(self, frame: Frame, names: List[str], confidence: float = 0.8):
+        """
+        :param frame: frame that shows at least one of the reference templates
+        :param names: reference template names
+        :param confidence: minimum confidence for the result to be accepted
+        :return: (scale, confidence), scale is None when no reference template reaches confidence
+        """
+        if frame.size in self.calibrated:
+            return self.calibrated[frame.size], 1.0
+
+        # coarse sweep on the half size frame, templates are resized to scale / 2 to match it
+        scores = {}
+        scale = self.max_scale
+        while scale >= self.min_scale - 1e-9:
+            scores[round(scale, 2)] = self._score(frame.pyramid(1), names, scale / 2)
+            scale -= self.coarse_step
+        best = max(scores, key=lambda key: scores[key][0])
+
+        # refine the best reference template at full resolution, only around its coarse location
+        _, name, (left, top, width, height) = scores[best]
+        pad = max(width, height)
+        x0, y0 = max(left * 2 - pad, 0), max(top * 2 - pad, 0)
+        window = frame.gray[y0:top * 2 + height * 2 + pad, x0:left * 2 + width * 2 + pad]
+
+        best_score = self._score(window, [name], best)[0]
+        step = self.coarse_step / 2
+        while step >= self.fine_step - 1e-9:
+            for candidate in (best - step, best + step):
+                candidate = round(candidate, 2)
+                if not self.min_scale <= candidate <= self.max_scale:
+                    continue
+                score = self._score(window, [name], candidate)[0]
+                if score > best_score:
+                    best, best_score = candidate, score
+            step /= 2
+
+        if self.log is not None:
+            coarse = {key: round(val[0], 3) for key, val in scores.items()}
+            self.log.debug(f"Coarse scores: {coarse}, best {name} at {best} ({best_score:.3f})")
+        if best_score < confidence:
+            return None, best_score
+
+        self.calibrated[frame.size] = best
+        return best, best_score
+
+    def _score(self, gray, names, scale):
+        """
+        :return: (confidence, name, box) of the best scoring template at scale
+        """
+        best = (0.0, names[0], (0, 0, 0, 0))
+        for name in names:
+            confidence, box = self.templates.get(name, scale).match(gray)
+            if confidence > best[0]:
+                best = (confidence, name, box)
+        return best
@@ -0,0 +1,264 @@
+import hashlib
+import logging
+import pathlib
+import time
+from pathlib import Path
+from typing import Union, List, Dict, Tuple
+
+import cv2
+import numpy as np
+
+IMG_SUFFIXES = (".png", ".jpg", ".jpeg", ".bmp")
+
+
+class Template:
+    def __init__(self, name: str, scale: float, path: pathlib.PurePath = None, gray: np.ndarray = None) -> None:
+        """
+        Decoded grayscale template with precomputed statistics
+        :param name: image file name, e.g. 'go.png'
+        :param scale: scale of the image set the template belongs to
+        :param path: image file on disk
+        :param gray: already decoded grayscale array, path is not read when given
+        """
+        assert path is not None or gray is not None, "Either path or gray must have value"
+        self.name = name
+        self.scale = scale
+        self.path = None if path is None else Path(path)
+        self.gray = None
+        self.mtime = None
+        self.mean = self.std = 0.0
+        self._levels = {}
+
+        if gray is None:
+            self.load()
+        else:
+            self._set_gray(gray)
+
+    def load(self):
+        gray = cv2.imread(str(self.path), cv2.IMREAD_GRAYSCALE)
+        assert gray is not None, f"Unable to read template {self.path}"
+
+        self.mtime = self.path.stat().st_mtime
+        self._set_gray(gray)
+
+    def _set_gray(self, gray: np.ndarray):
+        self.gray = gray
+        self._levels = {}
+        mean, std = cv2.meanStdDev(gray)
+        self.mean, self.std = float(mean[0][0]), float(std[0][0])
+
+    def level(self, level: int) -> "Template":
+        """
+        template downsampled to a pyramid level of the frame (each level halves the size)
+        """
+        if level == 0:
+            return self
+        if level not in self._levels:
+            gray = self.level(level - 1).gray
+            self._levels[level] = Template(self.name, self.scale, gray=cv2.pyrDown(gray))
+        return self._levels[level]
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return self.gray.shape[:2]
+
+    def is_stale(self) -> bool:
+        if self.path is None:
+            return False
+        return not self.path.exists() or self.path.stat().st_mtime != self.mtime
+
+    def match(self, gray: np.ndarray) -> Tuple[float, Tuple[int, int, int, int]]:
+        """
+        run template matching on a grayscale image
+        :param gray: grayscale image to search in
+        :return: best confidence and its (left, top, width, height)
+        """
+        height, width = self.shape
+        if gray.shape[0] < height or gray.shape[1] < width:
+            return 0.0, (0, 0, 0, 0)
+
+        result = cv2.matchTemplate(gray, self.gray, cv2.TM_CCOEFF_NORMED)
+        _, max_val, _, (left, top) = cv2.minMaxLoc(result)
+        return float(max_val), (left, top, width, height)
+
+
+class TemplateCache:
+    def __init__(self,
+                 roots: List[Union[pathlib.PurePath, str]],
+                 log: logging = None,
+                 reload_interval: float = 5.0,
+                 bank=None) -> None:
+        """
+        Decode template images once and keep them in memory, keyed by (name, scale).
+        Images directly inside a root are scale 1.0, images inside scale folders (e.g. '0_95') use that scale.
+        :param roots: folders to index, e.g. azurlane/GUI, ships_to_enhance, secretaries
+        :param log: logger
+        :param reload_interval: seconds between mtime checks, 0 or less disables auto reload
+        :param bank: TemplateBank the templates it holds are taken from instead of decoding their image
+        """
+        self.roots = []
+        for root in roots:
+            root = Path(root)
+            if root not in self.roots:
+                self.roots.append(root)
+        self.log = log
+        self.reload_interval = reload_interval
+
+        self.paths: Dict[Tuple[str, float], Path] = {}
+        self.templates: Dict[Tuple[str, float], Template] = {}
+        self.last_check = time.time()
+        self.bank = bank
+        self._scan()
+
+    @staticmethod
+    def to_scale(folder_name: str):
+        """
+        convert scale folder name to float, '0_95' -> 0.95. None if folder is not a scale folder
+        """
+        try:
+            return round(float(folder_name.replace("_", ".")), 2)
+        except ValueError:
+            return None
+
+    def _scan(self):
+        paths = {}
+        for root in self.roots:
+            for path in root.iterdir():
+                if path.is_dir():
+                    scale = self.to_scale(path.name)
+                    if scale is None:
+                        continue
+                    for img_path in path.iterdir():
+                        if img_path.suffix.lower() in IMG_SUFFIXES:
+                            # originals take priority over the copies in the '1_0' folder
+                            paths.setdefault((img_path.name, scale), img_path)
+                elif path.suffix.lower() in IMG_SUFFIXES:
+                    paths[(path.name, 1.0)] = path
+        self.paths = paths
+
+    def get(self, name: str, scale: float = 1.0) -> Template:
+        """
+        get template by name and scale, decoded on first use.
+        Scales without an image set on disk are resized in memory from the original, never written to disk.
+        """
+        self._maybe_reload()
+
+        key = (name, round(scale, 2))
+        template = self.templates.get(key)
+        if template is None:
+            gray = None if self.bank is None else self.bank.get(*key)
+            if gray is not None:
+                # mapped from the bank, the image is still reloaded when it changes on disk
+                path = self.paths.get(key)
+                template = Template(name, key[1], path, gray=gray)
+                template.mtime = None if path is None else self.bank.mtime(path)
+            elif key in self.paths:
+                template = Template(name, key[1], self.paths[key])
+            else:
+                assert (name, 1.0) in self.paths, f"Template {name} at scale {scale} not Found."
+                template = Template(name, key[1], gray=self._resize(self.get(name, 1.0).gray, key[1]))
+            self.templates[key] = template
+        return template
+
+    @staticmethod
+    def _resize(gray: np.ndarray, scale: float) -> np.ndarray:
+        height, width = gray.shape[:2]
+        size = (max(int(round(width * scale)), 1), max(int(round(height * scale)), 1))
+        interpolation = cv2.INTER_AREA if scale < 1.0 else cv2.INTER_LINEAR
+        return cv2.resize(gray, size, interpolation=interpolation)
+
+    def attach(self, bank) -> bool:
+        """
+        take templates from bank from now on, when it was built from the current images
+        :return: False when the bank is stale and was not attached
+        """
+        if bank is None or not bank.fresh(self.paths):
+            return False
+        self.bank = bank
+        self.templates = {key: x for key, x in self.templates.items() if not bank.has(*key)}
+        return True
+
+    def detach(self):
+        """
+        stop taking templates from the bank and close it, templates already taken from it are copied to memory.
+        Windows does not replace a mapped file, not even one mapped by this process
+        """
+        if self.bank is None:
+            return
+        for template in self.templates.values():
+            if isinstance(template.gray, np.memmap):
+                template.gray = np.array(template.gray)
+        self.bank.close()
+        self.bank = None
+
+    def has(self, name: str, scale: float = 1.0) -> bool:
+        return (name, round(scale, 2)) in self.paths or (name, 1.0) in self.paths
+
+    def preload(self, scale: float = None):
+        """
+        decode every template of a scale (all image sets on disk if None)
+        """
+        if scale is None:
+            for name, key_scale in self.paths:
+                self.get(name, key_scale)
+        else:
+            for name in self.names(scale):
+                self.get(name, scale)
+
+    def names(self, scale: float = 1.0, contains: str = "") -> List[str]:
+        scale = round(scale, 2)
+        return sorted({name for name, key_scale in self.paths if key_scale in (scale, 1.0) and contains in name})
+
+    def digest(self) -> str:
+        """
+        sha1 of the names and contents of the original templates, changes when a GUI image is replaced
+        """
+        sha1 = hashlib.sha1()
+        for name, scale in sorted(key for key in self.paths if key[1] == 1.0):
+            sha1.update(name.encode())
+            sha1.update(self.paths[(name, scale)].read_bytes())
+        return sha1.hexdigest()
+
+    def scales(self) -> List[float]:
+        """
+        scales of the image sets on disk
+        """
+        return sorted({scale for _, scale in self.paths}, reverse=True)
+
+    def reload(self) -> List[Tuple[str, float]]:
+        """
+        re-index roots and re-decode templates whose file changed on disk
+        :return: keys of reloaded/removed templates
+        """
+        self._scan()
+        changed = []
+        for key, template in list(self.templates.items()):
+            if template.path is None:
+                continue
+            if key not in self.paths:
+                del self.templates[key]
+                changed.append(key)
+            elif self.paths[key] != template.path or template.is_stale():
+                template.path = self.paths[key]
+                template.load()
+                changed.append(key)
+
+        # templates resized in memory follow their original
+        for key, template in list(self.templates.items()):
+            name, scale = key
+            if template.path is not None or (name, 1.0) not in changed:
+                continue
+            if (name, 1.0) in self.templates:
+                template._set_gray(self._resize(self.templates[(name, 1.0)].gray, scale))
+            else:
+                del self.templates[key]
+            changed.append(key)
+
+        if changed and self.log is not None:
+            self.log.info(f"Reloaded templates: {changed}")
+        self.last_check = time.time()
+        return changed
+
+    def _maybe_reload(self):
+        if self.reload_interval > 0 and time.time() - self.last_check > self.reload_interval:
+            self.reload()
@@ -0,0 +1,142 @@
+import bisect
+import logging
+import time
+from typing import Union, List, Dict, Callable, Optional
+
+from azurlane.frame import FrameSource
+from azurlane.matcher import Match, MultiMatcher
+
+# upper bounds (seconds) of the latency histogram buckets
+BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0, float("inf"))
+
+
+class LatencyHistogram:
+    def __init__(self) -> None:
+        """
+        Distribution of how long a screen transition took
+        """
+        self.counts = [0] * len(BUCKETS)
+        self.timeouts = 0
+        self.total = 0.0
+
+    def add(self, latency: float):
+        self.counts[bisect.bisect_left(BUCKETS, latency)] += 1
+        self.total += latency
+
+    @property
+    def hits(self) -> int:
+        return sum(self.counts)
+
+    def percentile(self, pct: float) -> float:
+        """
+        :return: upper bound of the bucket holding the percentile
+        """
+        target, seen = self.hits * pct / 100, 0
+        for bound, count in zip(BUCKETS, self.counts):
+            seen += count
+            if count and seen >= target:
+                return bound
+        return 0.0
+
+    def __repr__(self):
+        mean = self.total / self.hits if self.hits else 0.0
+        buckets = " ".join(f"<={bound}:{count}" for bound, count in zip(BUCKETS, self.counts) if count)
+        return f"hits={self.hits} timeouts={self.timeouts} mean={mean:.2f}s p95<={self.percentile(95)}s [{buckets}]"
+
+
+class Waiter:
+    def __init__(self,
+                 source: FrameSource,
+                 matcher: MultiMatcher,
+                 log: logging = None,
+                 min_poll: float = 0.05,
+                 max_poll: float = 1.0,
+                 smoothing: float = 0.3) -> None:
+        """
+        Wait until templates show up on screen, polling at a rate learned from how long each transition took
+        before: slow while the transition is not expected to be done yet, fast once it is.
+        :param source: frame source
+        :param matcher: matcher used on every polled frame
+        :param log: logger
+        :param min_poll: fastest poll interval in seconds
+        :param max_poll: slowest poll interval in seconds
+        :param smoothing: weight of the newest latency in the moving average of a transition
+        """
+        self.source = source
+        self.matcher = matcher
+        self.log = log
+        self.min_poll = min_poll
+        self.max_poll = max_poll
+        self.smoothing = smoothing
+
+        self.expected: Dict[str, float] = {}  # moving average latency per transition
+        self.histograms: Dict[str, LatencyHistogram] = {}
+        self.frame = None  # last polled frame and its matches, reusable by the caller
+        self.matches: Dict[str, Match] = {}
+
+    def wait_for(self,
+                 names: Union[str, List[str], Dict[str, float]],
+                 timeout: float = 10,
+                 poll: float = None,
+                 transition: str = None,
+                 stop: Callable[[], bool] = None,
+                 after: Dict[str, float] = None) -> Optional[Match]:
+        """
+        :param names: template name(s), or {name: confidence}
+        :param timeout: seconds to give up after
+        :param poll: fixed poll interval, else adaptive
+        :param transition: name the latency is recorded under, defaults to the template names
+        :param stop: returns True to stop waiting early, e.g. when the keyboard listener ended
+        :param after: {name: seconds} only accept these templates after some time, e.g. a button just clicked
+        :return: best Match that hit, None on timeout/stop
+        """
+        if isinstance(names, str):
+            names = [names]
+        group = names if isinstance(names, dict) else {name: 0.8 for name in names}
+        transition = "|".join(sorted(group)) if transition is None else transition
+        after = {} if after is None else after
+        histogram = self.histograms.setdefault(transition, LatencyHistogram())
+
+        start = time.time()
+        while True:
+            self.frame = self.source.grab()
+            matches = self.matcher.match(self.frame, group, polling=True)
+            # leave out misses not searched on the full frame, a later lookup on this frame searches them again
+            self.matches = {name: m for name, m in matches.items() if name not in self.matcher.deferred}
+            elapsed = self.frame.timestamp - start
+            hits = [m for m in self.matches.values() if m.hit and elapsed >= after.get(m.name, 0)]
+            if hits:
+                self._record(transition, elapsed)
+                return max(hits, key=lambda m: m.confidence)
+
+            elapsed = time.time() - start
+            if elapsed >= timeout or (stop is not None and stop()):
+                histogram.timeouts += 1
+                if self.log is not None:
+                    self.log.debug(f"Gave up waiting for {transition} after {elapsed:.2f}s")
+                return None
+
+            interval = poll if poll is not None else self._interval(transition, elapsed)
+            time.sleep(max(min(interval, timeout - elapsed), 0))
+
+    def _interval(self, transition: str, elapsed: float) -> float:
+        expected = self.expected.get(transition)
+        if expected is None or elapsed >= expected * 0.5:
+            return self.min_poll
+        # transition usually takes longer, sleep until half of its usual latency
+        return min(max(expected * 0.5 - elapsed, self.min_poll), self.max_poll)
+
+    def _record(self, transition: str, latency: float):
+        self.histograms[transition].add(latency)
+        previous = self.expected.get(transition)
+        self.expected[transition] = latency if previous is None else \
+            previous + self.smoothing * (latency - previous)
+
+    def report(self):
+        """
+        log latency histogram of every transition, used to tune timeouts
+        """
+        if self.log is None:
+            return
+        for transition, histogram in sorted(self.histograms.items()):
+            self.log.info(f"Wait {transition}: {histogram}")
@@ -0,0 +1,62 @@
+import time
+from typing import Tuple
+
+from azurlane.inputs import InputBackend
+
+
+class Window:
+    def __init__(self, title: str = None, rect: Tuple[int, int, int, int] = None, refresh: float = 1.0) -> None:
+        """
+        Screen area the emulator is drawn in. Capture is limited to it and every coordinate the bot works with is
+        relative to its top left corner, so the window can be moved while pybot runs.
+        :param title: part of the emulator window title, e.g. 'BlueStacks', the window is looked up by it
+        :param rect: fixed (left, top, width, height) in screen pixels, used instead of a title
+        :param refresh: seconds the window position is cached before it is looked up again
+        """
+        assert title is not None or rect is not None, "Either title or rect must have value"
+        self.title = title
+        self.fixed = rect
+        self.refresh = refresh
+        self.cached = rect
+        self.checked = 0.0
+
+    def rect(self) -> Tuple[int, int, int, int]:
+        """
+        :return: current (left, top, width, height) in screen pixels
+        """
+        if self.fixed is not None:
+            return self.fixed
+        if self.cached is None or time.time() - self.checked >= self.refresh:
+            self.cached = self._find()
+            self.checked = time.time()
+        return self.cached
+
+    @property
+    def origin(self) -> Tuple[int, int]:
+        left, top, _, _ = self.rect()
+        return left, top
+
+    def _find(self) -> Tuple[int, int, int, int]:
+        import pygetwindow  # only import when the window is looked up by title
+
+        windows = [x for x in pygetwindow.getWindowsWithTitle(self.title) if x.width > 0 and not x.isMinimized]
+        assert len(windows) != 0, f"No visible window with '{self.title}' in its title"
+        window = windows[0]
+        return window.left, window.top, window.width, window.height
+
+
+class WindowInput(InputBackend):
+    def __init__(self, backend: InputBackend, window: Window) -> None:
+        """
+        Translate window relative clicks and drags to screen pixels, with the position the window has at click time
+        """
+        self.backend = backend
+        self.window = window
+
+    def click(self, x: int, y: int, hold: float = 0.5):
+        left, top = self.window.origin
+        self.backend.click(x + left, y + top, hold)
+
+    def drag(self, x0: int, y0: int, x1: int, y1: int, duration: float = 0.5):
+        left, top = self.window.origin
+        self.backend.drag(x0 + left, y0 + top, x1 + left, y1 + top, duration)
@@ -0,0 +1,483 @@
+"""
+Offline benchmarks for the matching pipeline, runs on recorded frames without an emulator.
+    python benchmark.py matcher --frames ./recordings/enhance --scale 1.0
+    python benchmark.py replay --archive ./recordings/farm.zip --json ./bench.json
+    python benchmark.py pipeline --archive ./recordings/farm.zip --capture_ms 40
+    python benchmark.py startup --json ./startup.json
+    python benchmark.py bank --scale 0.8
+Archives are recorded with 'python pybot.py --record ./recordings/farm.zip'.
+"""
+import argparse
+import inspect
+import io
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from azurlane.Button import Button
+from azurlane.al_stage import RUN_GROUP
+from azurlane.enhance import ENHANCE_GROUP
+from azurlane.frame import FrameSource, RecordedSource
+from azurlane.inputs import FakeInput
+from azurlane.matcher import MultiMatcher
+from azurlane.metrics import Metrics
+from azurlane.replay import RecordingSource, ReplaySource
+from azurlane.roi import RoiTracker
+from azurlane.templates import TemplateCache
+
+
+def synthetic_frames(templates: TemplateCache, names, scale=1.0, count=5, size=(1920, 1080), seed=0, fixed=False):
+    """
+    build frames with some of the templates pasted on a noisy background, used when no recording is given
+    :param fixed: every template keeps the same position in all frames, like buttons on the real game screen
+    """
+    rng = np.random.default_rng(seed)
+    width, height = size
+    positions = {}
+    frames = []
+    for _ in range(count):
+        canvas = rng.integers(0, 60, (height, width), dtype=np.uint8)
+        for name in rng.choice(names, size=max(1, len(names) // 2), replace=False):
+            gray = templates.get(name, scale).gray
+            if name not in positions or not fixed:
+                positions[name] = (int(rng.integers(0, height - gray.shape[0])),
+                                   int(rng.integers(0, width - gray.shape[1])))
+            top, left = positions[name]
+            canvas[top:top + gray.shape[0], left:left + gray.shape[1]] = gray
+        frames.append(cv2.cvtColor(canvas, cv2.COLOR_GRAY2BGR))
+    return frames
+
+
+def load_frames(args, templates, names, fixed=False):
+    if args.frames is None:
+        images = synthetic_frames(templates, names, args.scale, fixed=fixed)
+    else:
+        source = RecordedSource(args.frames)
+        images = [source.grab().image for _ in source.paths]
+    return images
+
+
+def timed(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def bench_matcher(args, templates):
+    """
+    latency of the current sequential Button lookups against one MultiMatcher call per frame
+    """
+    from azurlane.frame import Frame
+
+    names = dict(RUN_GROUP, **ENHANCE_GROUP)
+    images = load_frames(args, templates, list(names))
+
+    def sequential():
+        for image in images:
+            frame = Frame(image)
+            for name, confidence in names.items():
+                Button(template=templates.get(name, args.scale), confidence=confidence, frame=frame)
+
+    def batched(matcher):
+        def run():
+            for image in images:
+                matcher.match(Frame(image), names)
+        return run
+
+    results = {"sequential Button": timed(sequential, args.repeat)}
+    for workers in (0, args.workers):
+        matcher = MultiMatcher(templates, args.scale, workers=workers)
+        results[f"MultiMatcher workers={workers}"] = timed(batched(matcher), args.repeat)
+        matcher.close()
+
+    print(f"{len(names)} templates x {len(images)} frames, mean of {args.repeat} runs")
+    for label, ms in results.items():
+        print(f"{label:>28} : {ms / len(images):8.2f} ms/frame")
+
+
+def bench_roi(args, templates):
+    """
+    per lookup cost of a full frame scan against a search around the last hit. One off lookups scan the full
+    frame after every ROI miss, polled ones (Waiter) only every RoiTracker.full_interval
+    """
+    from azurlane.frame import Frame
+
+    names = dict(RUN_GROUP, **ENHANCE_GROUP)
+    images = load_frames(args, templates, list(names), fixed=True)
+
+    for label, roi, polling in (("full frame", None, False), ("ROI", RoiTracker(), False),
+                                ("ROI, polling", RoiTracker(), True)):
+        matcher = MultiMatcher(templates, args.scale, roi=roi, static_threshold=0)
+        for image in images:  # warm up, learns the ROIs
+            matcher.match(Frame(image), names)
+        ms = timed(lambda: [matcher.match(Frame(image), names, polling=polling) for image in images], args.repeat)
+        print(f"{label:>12} : {ms / len(images) / len(names):8.2f} ms/lookup")
+        if roi is not None:
+            for name, stats in sorted(roi.stats().items()):
+                print(f"{name:>20} : {stats}")
+
+
+def bench_static(args, templates):
+    """
+    CPU time of matching a frame sequence with and without change detection. Synthetic sequences repeat every
+    frame a few times, like the emulator between animations
+    """
+    from azurlane.frame import Frame
+
+    names = dict(RUN_GROUP, **ENHANCE_GROUP)
+    images = load_frames(args, templates, list(names), fixed=True)
+    if args.frames is None:
+        images = [image for image in images for _ in range(4)]
+
+    for label, threshold in (("always match", 0), ("change detection", 4)):
+        matcher = MultiMatcher(templates, args.scale, roi=RoiTracker(), static_threshold=threshold)
+        start = time.process_time()
+        for _ in range(args.repeat):
+            matcher.reset()
+            for image in images:
+                matcher.match(Frame(image), names)
+        cpu = (time.process_time() - start) / args.repeat
+        skipped = matcher.skipped / max(matcher.skipped + matcher.matched, 1) * 100
+        print(f"{label:>18} : {cpu * 1000 / len(images):8.2f} ms cpu/frame, {skipped:5.1f}% lookups skipped")
+
+
+def _inspect_trace(offset=0):
+    """
+    previous helper.trace() implementation, kept for comparison
+    """
+    offset += 1
+    return f"{os.path.basename(inspect.stack()[offset].filename)}:{inspect.stack()[offset].lineno}: " \
+           f"{inspect.stack()[offset].function}()"
+
+
+def bench_trace(args, templates):
+    """
+    cost of prefixing log calls with the caller location, for a record that is emitted and one dropped by level
+    """
+    import helper as h
+    from Logger import TraceFilter
+
+    handler = logging.StreamHandler(io.StringIO())
+    handler.addFilter(TraceFilter())
+    handler.setFormatter(logging.Formatter('%(levelname)-8s %(trace)s %(message)s'))
+    log = logging.getLogger("benchmark.trace")
+    log.propagate = False
+    log.addHandler(handler)
+    log.setLevel(logging.INFO)
+
+    count = 2000
+    cases = {
+        "inspect.stack() emitted": lambda: log.info(f"{_inspect_trace()} Clicked Go ..."),
+        "inspect.stack() dropped": lambda: log.debug(f"{_inspect_trace()} Clicked Go ..."),
+        "helper.trace() emitted": lambda: log.info(f"{h.trace()} Clicked Go ..."),
+        "TraceFilter emitted": lambda: log.info("Clicked Go ..."),
+        "TraceFilter dropped": lambda: log.debug("Clicked Go ..."),
+    }
+    for label, fn in cases.items():
+        us = timed(lambda: [fn() for _ in range(count)], args.repeat) * 1000 / count
+        print(f"{label:>24} : {us:8.2f} us/call")
+
+
+class ScriptedSource(FrameSource):
+    def __init__(self, templates: TemplateCache, scale: float, size=(1280, 720), seed=0) -> None:
+        """
+        Draw game screens from templates on a fixed smooth background, every template at a fixed position
+        """
+        super().__init__()
+        self.templates = templates
+        self.scale = scale
+        self.size = size
+        self.rng = np.random.default_rng(seed)
+        self.positions = {}
+        self.screen = []
+        self.background = cv2.resize(self.rng.integers(0, 60, (18, 32), dtype=np.uint8), size)
+
+    def grab(self):
+        width, height = self.size
+        canvas = self.background.copy()
+        for name in self.screen:
+            gray = self.templates.get(name, self.scale).gray
+            if name not in self.positions:
+                self.positions[name] = (int(self.rng.integers(0, height - gray.shape[0])),
+                                        int(self.rng.integers(0, width - gray.shape[1])))
+            top, left = self.positions[name]
+            canvas[top:top + gray.shape[0], left:left + gray.shape[1]] = gray
+        return self._new_frame(cv2.cvtColor(canvas, cv2.COLOR_GRAY2BGR))
+
+
+def synthetic_archive(templates: TemplateCache, path, scale=1.0, loops=3):
+    """
+    record a scripted farming session: main menu, then 'loops' times stage select -> fleet select -> battle ->
+    result, with a click after every screen
+    :return: {name: (top, left)} of every template drawn
+    """
+    scripted = ScriptedSource(templates, scale)
+    recording = RecordingSource(scripted, path)
+    screens = [(["secretary1.png", "battle.png"], 3)]
+    for _ in range(loops):
+        screens += [(["stage_12.png"], 3), (["go.png"], 3), ([], 8), (["continue.png"], 3)]
+    for names, count in screens:
+        scripted.screen = names
+        for _ in range(count):
+            recording.grab()
+        if names:
+            gray = templates.get(names[-1], scale).gray
+            top, left = scripted.positions[names[-1]]
+            recording.action(left + gray.shape[1] // 2, top + gray.shape[0] // 2, 0.2)
+    recording.close()
+    return scripted.positions
+
+
+def bench_replay(args, templates):
+    """
+    run calibration, pybot.init_btn and Stage.run headless on a recorded archive: per template match time,
+    frames per decision and loop time
+    """
+    import pybot
+    from azurlane.al_stage import Stage, ROI_HINTS
+    from azurlane.wait import Waiter
+    from rescale import Scaler
+
+    archive = args.archive
+    if archive is None:
+        archive = Path(tempfile.mkdtemp()) / "synthetic.zip"
+        synthetic_archive(templates, archive, args.scale)
+
+    log = logging.getLogger("benchmark.replay")
+    source = ReplaySource(archive)
+    Button.input = FakeInput(source)
+    results = {"archive": str(archive)}
+
+    start = time.perf_counter()
+    sc = Scaler(args.gui_path, args.ship_path, args.secretary_path, log, source=source)
+    scale = sc.calibrate()
+    results["calibrate_s"] = time.perf_counter() - start
+    assert scale is not None, "Unable to calibrate on the first frame of the archive"
+
+    metrics = Metrics()
+    matcher = MultiMatcher(sc.templates, scale, roi=RoiTracker(ROI_HINTS), metrics=metrics)
+    waiter = Waiter(source, matcher, log)
+    start = time.perf_counter()
+    back_coords = pybot.init_btn(sc.templates.names(scale, contains="secretary"), waiter, confidence=0.7).get_coords()
+    battle_coords = pybot.init_btn("battle.png", waiter).get_coords()
+    results["init_btn_s"] = time.perf_counter() - start
+
+    stage = Stage(sc.templates, scale, back_coords, battle_coords, log, source=source, matcher=matcher,
+                  waiter=waiter)
+    start = time.perf_counter()
+    while source.running:
+        stage.run(source)
+    elapsed = time.perf_counter() - start
+
+    clicks = len(Button.input.clicks)
+    results.update({"scale": scale, "frames": source.count, "clicks": clicks, "loops": stage.loops,
+                    "frames_per_decision": source.count / max(clicks, 1), "run_s": elapsed,
+                    "loop_s": elapsed / stage.loops if stage.loops else None, "templates": metrics.summary()})
+
+    print(f"{archive}: scale {scale}, {source.count} frames, {clicks} clicks, {stage.loops} loops")
+    for key in ("calibrate_s", "init_btn_s", "run_s", "loop_s", "frames_per_decision"):
+        print(f"{key:>24} : {results[key]}")
+    for name, stats in results["templates"].items():
+        print(f"{name:>24} : {stats['lookups']:5d} lookups p50={stats['p50_ms']:.2f}ms p95={stats['p95_ms']:.2f}ms")
+    if args.json is not None:
+        args.json.write_text(json.dumps(results, indent=2))
+
+
+class DelayedSource(FrameSource):
+    def __init__(self, source: FrameSource, capture_ms: float) -> None:
+        """
+        Replayed frames that take as long to capture as a live screenshot
+        """
+        super().__init__()
+        self.source = source
+        self.capture_ms = capture_ms
+
+    def grab(self):
+        started = time.perf_counter()
+        frame = self.source.grab()
+        time.sleep(max(self.capture_ms / 1000 - (time.perf_counter() - started), 0))
+        frame.capture_ms = (time.perf_counter() - started) * 1000
+        self.count += 1
+        return frame
+
+
+class HeldInput(FakeInput):
+    """
+    FakeInput that takes as long as a real click held for hold seconds
+    """
+
+    def click(self, x: int, y: int, hold: float = 0.5):
+        time.sleep(hold)
+        super().click(x, y, hold)
+
+
+def bench_pipeline(args, templates):
+    """
+    Stage.run on a recorded archive with serial capture/match/click and with the pipelined runtime, frames take
+    --capture_ms to capture and clicks are held --click_hold
+    """
+    import pybot
+    from azurlane.al_stage import Stage, ROI_HINTS
+    from azurlane.pipeline import PipelinedSource, PipelinedInput
+    from azurlane.wait import Waiter
+    from rescale import Scaler
+
+    archive = args.archive
+    if archive is None:
+        archive = Path(tempfile.mkdtemp()) / "synthetic.zip"
+        synthetic_archive(templates, archive, args.scale)
+
+    log = logging.getLogger("benchmark.pipeline")
+    replay = ReplaySource(archive)
+    scale = Scaler(args.gui_path, args.ship_path, args.secretary_path, log, source=replay).calibrate()
+    assert scale is not None, "Unable to calibrate on the first frame of the archive"
+    replay.rewind()
+    waiter = Waiter(replay, MultiMatcher(templates, scale), log)
+    back_coords = pybot.init_btn(templates.names(scale, contains="secretary"), waiter, confidence=0.7).get_coords()
+    battle_coords = pybot.init_btn("battle.png", waiter).get_coords()
+
+    results = {"archive": str(archive), "capture_ms": args.capture_ms, "click_hold": args.click_hold}
+    for mode in ("serial", "pipelined"):
+        replay.rewind()
+        fake = HeldInput(replay)
+        source, backend = DelayedSource(replay, args.capture_ms), fake
+        if mode == "pipelined":
+            source = PipelinedSource(source)
+            backend = PipelinedInput(fake, source)
+            source.start(replay)
+        matcher = MultiMatcher(templates, scale, workers=args.workers if mode == "pipelined" else 0,
+                               roi=RoiTracker(ROI_HINTS))
+        waiter = Waiter(source, matcher, log, min_poll=0 if mode == "pipelined" else 0.05)
+        stage = Stage(templates, scale, back_coords, battle_coords, log, source=source, matcher=matcher,
+                      waiter=waiter, click_hold=args.click_hold, input_backend=backend)
+        start = time.perf_counter()
+        while replay.running:
+            stage.run(replay)
+        elapsed = time.perf_counter() - start
+        if mode == "pipelined":
+            source.stop()
+            backend.stop()
+        matcher.close()
+
+        results[mode] = {"run_s": elapsed, "frames": source.count, "clicks": len(fake.clicks), "loops": stage.loops,
+                         "decision_s": elapsed / max(len(fake.clicks), 1),
+                         "loop_s": elapsed / stage.loops if stage.loops else None}
+        print(f"{mode:>10} : {elapsed:.2f}s, {source.count} frames, {len(fake.clicks)} clicks, "
+              f"{stage.loops} loops, {results[mode]['decision_s'] * 1000:.0f}ms per decision")
+    if args.json is not None:
+        args.json.write_text(json.dumps(results, indent=2))
+
+
+def import_times(module: str):
+    """
+    :return: {module: cumulative microseconds} of every import done by 'import module', from python -X importtime
+    """
+    stderr = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], capture_output=True,
+                            text=True, check=True).stderr
+    times = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        times[name.strip()] = max(times.get(name.strip(), 0), int(cumulative))
+    return times
+
+
+def bench_startup(args, templates):
+    """
+    time to import pybot (python -X importtime), to print its help and to set up Logger.Log, best of --repeat
+    """
+    results = {}
+    runs = [import_times("pybot") for _ in range(args.repeat)]
+    best = min(runs, key=lambda x: x["pybot"])
+    results["import_pybot_ms"] = best["pybot"] / 1000
+    results["imports_ms"] = {name: best[name] / 1000 for name in sorted(best, key=best.get, reverse=True)[:15]}
+
+    help_s = []
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "pybot.py", "--help"], capture_output=True, check=True)
+        help_s.append(time.perf_counter() - start)
+    results["help_ms"] = min(help_s) * 1000
+
+    code = "import time; start = time.perf_counter(); import Logger, tempfile; " \
+           "Logger.Log(tempfile.mkdtemp(), con_lvl='ERROR'); print(time.perf_counter() - start)"
+    log_s = [float(subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout)
+             for _ in range(args.repeat)]
+    results["log_init_ms"] = min(log_s) * 1000
+
+    for key in ("import_pybot_ms", "help_ms", "log_init_ms"):
+        print(f"{key:>24} : {results[key]:.1f}")
+    for name, ms in results["imports_ms"].items():
+        print(f"{name:>24} : {ms:8.1f} ms cumulative")
+    if args.json is not None:
+        args.json.write_text(json.dumps(results, indent=2))
+
+
+def bench_bank(args, templates):
+    """
+    time to get every template at 1.0 and --scale from decoded images and from a template bank
+    """
+    from azurlane.bank import TemplateBank
+
+    roots = [args.gui_path, args.ship_path, args.secretary_path]
+    path = Path(tempfile.mkdtemp()) / "templates.bank"
+    start = time.perf_counter()
+    count = TemplateBank.build(path, templates, [args.scale])
+    print(f"{'build':>24} : {(time.perf_counter() - start) * 1000:8.2f} ms, {count} templates, "
+          f"{path.stat().st_size / 1024:.0f} KiB")
+
+    def load(bank):
+        cache = TemplateCache(roots, reload_interval=0)
+        if bank:
+            assert cache.attach(TemplateBank(path)), "bank is stale"
+        cache.preload(1.0)
+        cache.preload(args.scale)
+
+    for label, bank in (("decode images", False), ("template bank", True)):
+        print(f"{label:>24} : {timed(lambda: load(bank), args.repeat):8.2f} ms")
+
+
+BENCHMARKS = {
+    "matcher": bench_matcher,
+    "roi": bench_roi,
+    "static": bench_static,
+    "trace": bench_trace,
+    "replay": bench_replay,
+    "pipeline": bench_pipeline,
+    "startup": bench_startup,
+    "bank": bench_bank,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="pybot offline benchmarks")
+    parser.add_argument("name", choices=sorted(BENCHMARKS))
+    parser.add_argument("--frames", type=Path, default=None, help="folder of recorded PNG frames")
+    parser.add_argument("--archive", type=Path, default=None, help="archive recorded with pybot.py --record")
+    parser.add_argument("--json", type=Path, default=None, help="write results to compare between commits")
+    parser.add_argument("--gui_path", type=Path, default=Path("./azurlane/GUI"))
+    parser.add_argument("--ship_path", type=Path, default=Path("./ships_to_enhance"))
+    parser.add_argument("--secretary_path", type=Path, default=Path("./secretaries"))
+    parser.add_argument("--scale", type=float, default=1.0)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--capture_ms", type=float, default=40, help="simulated capture time of the pipeline bench")
+    parser.add_argument("--click_hold", type=float, default=0.2, help="seconds a click is held in the pipeline bench")
+    args = parser.parse_args()
+
+    templates = TemplateCache([args.gui_path, args.ship_path, args.secretary_path], reload_interval=0)
+    BENCHMARKS[args.name](args, templates)
+
+
+if __name__ == '__main__':
+    main()
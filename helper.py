@@ -1,7 +1,7 @@
 import datetime as dt
-import inspect
 import operator
 import os
+import sys
 import time
 from datetime import timedelta
 from pathlib import Path
@@ -19,13 +19,25 @@ def getparentfname(suffix=True):
     get file name of the parent function that initiates current function
     :return : parent file path
     """
-    path = Path(inspect.stack()[-1][1])
+    frame = sys._getframe()  # outermost frame is the script, inspect.stack() would read the source of every frame
+    while frame.f_back is not None:
+        frame = frame.f_back
+    path = Path(frame.f_code.co_filename)
     return path.stem if suffix is False else path
 
 
 def trace(offset=0, lvl=1):
-    offset += 1
-    return f"{os.path.basename(inspect.stack()[offset].filename)}:{inspect.stack()[offset].lineno}: {inspect.stack()[offset].function}()" if lvl > 0 else ""
+    """
+    location of the caller, e.g. 'pybot.py:97: main()'. Only reads the one frame needed, unlike inspect.stack()
+    which builds source context for the whole stack. Log calls get this through Logger.TraceFilter instead.
+    :param offset: number of frames to go up from the caller
+    :param lvl: 0 returns empty string
+    """
+    if lvl <= 0:
+        return ""
+    frame = sys._getframe(offset + 1)
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{frame.f_lineno}: {code.co_name}()"
 
 
 def getuser():
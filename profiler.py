@@ -0,0 +1,185 @@
+import functools
+import logging
+import os
+import pathlib
+import sys
+import threading
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Union, Callable, Dict, List
+
+PROFILE_MODES = ("timers", "sample", "cprofile")
+
+
+class Profiler:
+    def __init__(self, mode: str = "timers", interval: float = 0.005) -> None:
+        """
+        Time the functions handed to wrap(). Nothing is patched until wrap() is called, so a run without
+        --profile pays nothing.
+        :param mode: 'timers' only times wrapped functions, 'sample' also samples the stacks of every thread,
+                     'cprofile' also runs cProfile on the main thread
+        :param interval: seconds between two stack samples
+        """
+        assert mode in PROFILE_MODES, f"Unknown profile mode {mode}, choose from {PROFILE_MODES}"
+        self.mode = mode
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.stats: Dict[str, List[float]] = {}  # {label: [calls, total, self, max]} seconds
+        self.stacks: Dict[str, float] = defaultdict(float)  # {'thread;outer;inner': self seconds}
+        self.samples: Dict[str, int] = defaultdict(int)  # {'thread;file:function;...': count}
+
+        self.started = None
+        self.elapsed = 0.0
+        self.stopped = threading.Event()
+        self.sampler = None
+        self.cprofile = None
+
+    def wrap(self, owner, attr: str, name: str = None, key: Callable = None):
+        """
+        replace owner.attr by a timed version of it
+        :param owner: class or module the function is looked up on
+        :param name: label in the report, defaults to 'Owner.attr'
+        :param key: called with the arguments of every call, its result is appended to the label, e.g. the
+                    template name to get a per template breakdown
+        """
+        func = getattr(owner, attr)
+        name = f"{getattr(owner, '__name__', owner)}.{attr}" if name is None else name
+
+        @functools.wraps(func)
+        def timed(*args, **kwargs):
+            label = name if key is None else f"{name}[{key(*args, **kwargs)}]"
+            return self._call(label, func, args, kwargs)
+
+        setattr(owner, attr, timed)
+
+    def _call(self, label: str, func: Callable, args, kwargs):
+        local = self.local
+        if not hasattr(local, "stack"):
+            local.stack = [threading.current_thread().name]
+            local.children = [0.0]
+        local.stack.append(label)
+        local.children.append(0.0)
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - started
+            own = elapsed - local.children.pop()
+            path = ";".join(local.stack)
+            local.stack.pop()
+            local.children[-1] += elapsed
+            with self.lock:
+                stat = self.stats.setdefault(label, [0, 0.0, 0.0, 0.0])
+                stat[0] += 1
+                stat[1] += elapsed
+                stat[2] += own
+                stat[3] = max(stat[3], elapsed)
+                self.stacks[path] += own
+
+    def start(self):
+        self.started = time.perf_counter()
+        if self.mode == "sample":
+            self.sampler = threading.Thread(target=self._sample, name="profile-sampler", daemon=True)
+            self.sampler.start()
+        elif self.mode == "cprofile":
+            import cProfile
+
+            self.cprofile = cProfile.Profile()
+            self.cprofile.enable()
+
+    def stop(self):
+        if self.started is None:
+            return
+        self.elapsed = time.perf_counter() - self.started
+        self.started = None
+        if self.sampler is not None:
+            self.stopped.set()
+            self.sampler.join()
+        if self.cprofile is not None:
+            self.cprofile.disable()
+
+    def _sample(self):
+        names = {}
+        while not self.stopped.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == threading.get_ident():
+                    continue
+                if ident not in names:
+                    names = {x.ident: x.name for x in threading.enumerate()}
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    if code.co_filename != __file__:  # leave out the timer wrappers
+                        stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.samples[";".join(reversed(stack))] += 1
+
+    def functions(self) -> Dict[str, List[float]]:
+        """
+        :return: {function: [calls, total, self, max]} with the per template labels of a function added up
+        """
+        functions = {}
+        for label, (calls, total, own, longest) in self.stats.items():
+            stat = functions.setdefault(label.split("[")[0], [0, 0.0, 0.0, 0.0])
+            stat[0] += calls
+            stat[1] += total
+            stat[2] += own
+            stat[3] = max(stat[3], longest)
+        return functions
+
+    def templates(self) -> Dict[str, List[float]]:
+        """
+        :return: {template: [calls, total, self, max]} of every label with a template key
+        """
+        templates = {}
+        for label, stat in self.stats.items():
+            if "[" in label:
+                templates[label] = stat
+        return templates
+
+    def report(self) -> str:
+        lines = [f"Profiled {self.elapsed:.2f}s, mode {self.mode}"]
+        for title, stats in (("function", self.functions()), ("template", self.templates())):
+            if len(stats) == 0:
+                continue
+            lines.append("")
+            lines.append(f"{title:<48} {'calls':>8} {'total_s':>9} {'self_s':>9} {'mean_ms':>9} {'max_ms':>9}")
+            for label, (calls, total, own, longest) in sorted(stats.items(), key=lambda x: -x[1][1]):
+                lines.append(f"{label:<48} {calls:>8d} {total:>9.3f} {own:>9.3f} {total / calls * 1000:>9.2f} "
+                             f"{longest * 1000:>9.2f}")
+        return "\n".join(lines)
+
+    def write(self, prefix: Union[pathlib.PurePath, str], log: logging = None) -> List[Path]:
+        """
+        write the breakdown to {prefix}.txt, the collapsed stacks to {prefix}.collapsed (flamegraph.pl or
+        speedscope) and the cProfile stats to {prefix}.prof
+        :return: written files
+        """
+        prefix = Path(prefix)
+        prefix.parent.mkdir(parents=True, exist_ok=True)
+        report = prefix.with_name(f"{prefix.name}.txt")
+        report.write_text(self.report() + "\n")
+        written = [report]
+
+        collapsed = prefix.with_name(f"{prefix.name}.collapsed")
+        if self.mode == "sample":
+            lines = [f"{stack} {count}" for stack, count in sorted(self.samples.items())]
+        else:  # self time of the wrapped functions in microseconds
+            lines = [f"{stack} {int(own * 1e6)}" for stack, own in sorted(self.stacks.items()) if own >= 1e-6]
+        collapsed.write_text("\n".join(lines) + "\n")
+        written.append(collapsed)
+
+        if self.cprofile is not None:
+            prof = prefix.with_name(f"{prefix.name}.prof")
+            self.cprofile.dump_stats(str(prof))
+            written.append(prof)
+
+        if log is not None:
+            for line in self.report().splitlines()[:20]:
+                if line:
+                    log.info(line)
+            log.info(f"Profile written to {', '.join(str(x) for x in written)}")
+        return written
@@ -1,19 +1,29 @@
 import argparse
+import logging
 import os
 import pathlib
 import sys
 from pathlib import Path
-from typing import Union, Set, List
+from typing import Union, List
 
-from pynput import keyboard
-from tqdm import tqdm
-
-import helper as h
 from Logger import Log
 from azurlane.Button import Button
-from azurlane.al_stage import Stage
-from rescale import Scaler
+from azurlane.al_stage import Stage, ROI_HINTS, CLICK_HOLD
+from azurlane.calibration import CalibrationStore
+from azurlane.capture import CAPTURE_BACKENDS, Win32Source, capture_backend
 from azurlane.enhance import Enhance
+from azurlane.inputs import FakeInput, INPUT_BACKENDS, input_backend
+from azurlane.matcher import MultiMatcher
+from azurlane.metrics import Metrics
+from azurlane.orchestrator import Orchestrator, SharedCapture, Instance
+from azurlane.pipeline import PipelinedSource, PipelinedInput
+from azurlane.replay import RecordingSource, RecordingInput, ReplaySource
+from azurlane.roi import RoiTracker
+from azurlane.templates import IMG_SUFFIXES
+from azurlane.wait import Waiter
+from azurlane.window import Window, WindowInput
+from profiler import PROFILE_MODES, Profiler
+from rescale import Scaler
 
 """ Initializing Script Parameters """
 parser = argparse.ArgumentParser(description="Automate Mobile Game (Azur Lane)")
@@ -39,6 +49,10 @@ parser.add_argument('--secretary_path',
                     help="Path to images of secretaries",
                     type=lambda x: Path(x).absolute(),
                     default="./secretaries")
+parser.add_argument('--disk_scale',
+                    help="include to generate scaled GUI image sets on disk and search them, "
+                         "else the scale is found in memory",
+                    action="store_true")
 parser.add_argument('-tgi',
                     '--test_gui_img',
                     help="include if you want to test if parameters are good",
@@ -48,83 +62,406 @@ parser.add_argument('-tpb',
                     help="include to run pybot without generating scalable GUI.",
                     action="store_true")
 
+parser.add_argument('--calibration_file',
+                    help="json file where the calibrated scale is stored per window size",
+                    type=lambda x: Path(x).absolute(),
+                    default="./calibration.json")
+parser.add_argument('--recalibrate',
+                    help="include to ignore the stored scale and calibrate again",
+                    action="store_true")
+parser.add_argument('--enhance_file',
+                    help="json file where the ships found fully enhanced are kept, they are not looked for again",
+                    type=lambda x: Path(x).absolute(),
+                    default="./enhanced.json")
+parser.add_argument('--reset_enhanced',
+                    help="include to look for every ship in --ship_path again, e.g. after replacing them",
+                    action="store_true")
+parser.add_argument('--log_rotate_mb',
+                    help="rotate the log file at this size in MB and compress it while running, 0 to disable",
+                    type=float,
+                    default=50)
+parser.add_argument('--log_keep',
+                    help="max number of compressed logs kept in log_dir, 0 for no limit",
+                    type=int,
+                    default=50)
+parser.add_argument('--metrics_file',
+                    help="jsonl or csv file every lookup/click is appended to, "
+                         "summarize with 'python -m azurlane.metrics <file>'",
+                    type=lambda x: Path(x).absolute(),
+                    default=None)
+parser.add_argument('--capture',
+                    help="screen capture backend, auto uses mss when installed else pyautogui",
+                    choices=["auto"] + sorted(CAPTURE_BACKENDS),
+                    default="auto")
+parser.add_argument('--input',
+                    help="click backend, auto uses win32 on Windows else pyautogui",
+                    choices=["auto"] + sorted(INPUT_BACKENDS),
+                    default="auto")
+parser.add_argument('--adb_serial',
+                    help="device serial for the adb backends, e.g. 127.0.0.1:5555",
+                    default=None)
+parser.add_argument('--window',
+                    help="part of the emulator window title, only that window is captured and clicks follow it "
+                         "when it moves",
+                    default=None)
+parser.add_argument('--window_rect',
+                    help="fixed LEFT TOP WIDTH HEIGHT of the emulator on screen, instead of --window",
+                    type=int,
+                    nargs=4,
+                    default=None)
+parser.add_argument('--instances',
+                    help="window titles of several emulators driven from this process, one Stage each",
+                    nargs="+",
+                    default=None)
+parser.add_argument('--click_hold',
+                    help="seconds a click is held down",
+                    type=float,
+                    default=CLICK_HOLD)
+parser.add_argument('--record',
+                    help="zip archive the captured frames and clicks are saved to, for replay and benchmark.py",
+                    type=lambda x: Path(x).absolute(),
+                    default=None)
+parser.add_argument('--replay',
+                    help="run headless against an archive saved with --record, clicks are not sent",
+                    type=lambda x: Path(x).absolute(),
+                    default=None)
+parser.add_argument('--pipeline',
+                    help="include to capture on a background thread and click from another one, matching does "
+                         "not wait for screenshots or clicks",
+                    action="store_true")
+parser.add_argument('--match_workers',
+                    help="threads matching the templates of one frame in parallel with --pipeline",
+                    type=int,
+                    default=min(4, os.cpu_count() or 1))
+parser.add_argument('--profile',
+                    help="time Scaler, init_btn, Stage.run, enhancing and every template match, written to log_dir "
+                         "at exit with a collapsed stack file for flame graphs. 'sample' also samples every thread, "
+                         "'cprofile' also runs cProfile",
+                    nargs="?",
+                    const="timers",
+                    choices=PROFILE_MODES,
+                    default=None)
+parser.add_argument('--sync_log',
+                    help="include to write log records from the calling thread instead of a background queue",
+                    action="store_true")
+
 """ Default Arguments """
 parser.add_argument('--log_dir',
                     type=lambda x: Path(x).absolute(),
                     default=os.getcwd() + "/log")
-args = parser.parse_args()
-
-""" Initializing Logging Properties """
-logs = Log(log_path=args.log_dir)
-log = logs.get_logger()
+args = None  # parsed when run as a script, pybot stays importable for replay and benchmarks
+log = logging.getLogger("pybot")  # replaced by the configured logger when run as a script
 
 """ Condition to end Script """
-esc_condition = (keyboard.Key.ctrl_l, keyboard.KeyCode(char="q"))
+esc_condition = ()  # (ctrl_l, 'q'), set once pynput is imported
 pressed_input = set()  # when input are pressed, it will be inserted here
 
 
 def main():
-    # generate scaled images and initialize pyautogui to use one set of scaled image
-    sc = Scaler(args.gui_path, args.ship_path, args.secretary_path, log)
-    if not args.test_pybot:
-        sc.down_scale(args.num_gui_gen, scale_percent=args.gui_scale)
-    gui_path = sc.init_img_path()
-
-    assert gui_path is not None, "Unable to find suitable GUI images for pybot. " \
-                                 "Please edit --num_gui_gen and --gui_scale so that pybot " \
-                                 "is able to identify gui buttons on emulator"
+    assert args.record is None or args.replay is None, "--record and --replay can not be used together"
 
-    # Initialize Back Button by using location of Secretary Image
-    sec_paths = [x for x in gui_path.iterdir() if 'secretary' in x.stem]
-    back_coords = init_btn(sec_paths, confidence=0.7, desc="Locating Secretary")
-    # Get Battle Button coords from Main Screen
-    battle_coords = init_btn(gui_path / "battle.png", desc="Locating Battle Btn")
+    store = CalibrationStore(args.calibration_file)
+    if args.recalibrate:
+        store.data = {}
+    metrics_file = args.log_dir / "metrics.jsonl" if args.metrics_file is None else args.metrics_file
+    if args.instances is not None:
+        run_instances(store, metrics_file)
+        return
 
-    al_stg = Stage(gui_path, back_coords, battle_coords, log)
+    # generate scaled images and initialize pyautogui to use one set of scaled image
+    replay = recording = None
+    if args.replay is not None:
+        source = replay = ReplaySource(args.replay)
+        Button.input = fake = FakeInput(source)
+    else:
+        source = capture_backend(args.capture, serial=args.adb_serial)
+        Button.input = input_backend(args.input, serial=args.adb_serial)
+        if args.window is not None or args.window_rect is not None:
+            assert args.capture != "adb", "adb frames are already limited to the emulator, drop --window"
+            rect = None if args.window_rect is None else tuple(args.window_rect)
+            source.window = Window(args.window, rect)
+            Button.input = WindowInput(Button.input, source.window)
+            log.info(f"Capturing window {source.window.rect()}")
+        elif isinstance(source, Win32Source):
+            # frames start at the top left of the virtual screen, which is not (0, 0) with a monitor left of or
+            # above the primary one
+            Button.input = WindowInput(Button.input, Window(rect=source.desktop()))
+    if args.test_gui_img:  # if true means only want to run scaler, buttons and Stage are not needed
+        init_scale(source, store)
+        return
+    if args.record is not None:
+        source = recording = RecordingSource(source, args.record)
+        Button.input = RecordingInput(Button.input, source)
+    if args.pipeline:
+        source = PipelinedSource(source)
+        Button.input = PipelinedInput(Button.input, source)
 
-    if not args.test_gui_img:  # if true means only want to run scaler
-        log.info(f"{h.trace()} Press Keyboard 'ctrl-l' release then 'q' to Quit ...")
+    al_stg = init_stage(source, store, metrics_file)
 
-        with keyboard.Listener(on_press=on_press) as listener:
+    if replay is not None:
+        start_pipeline(source, replay)
+        while replay.running:  # replay stops Stage like the keyboard listener does
+            al_stg.run(replay)
+        stop_pipeline(source)
+        log.info(f"Replayed {replay.count} frames, {len(fake.clicks)} clicks")
+        al_stg.report()
+        save_rois(store, al_stg)
+    else:
+        with start_listener() as listener:
+            start_pipeline(source, listener)
             while True:
                 al_stg.run(listener)
                 if not listener.running:
-                    log.info(f"{h.trace()} Force Ending Process")
+                    log.info("Force Ending Process")
                     break
+            stop_pipeline(source)
+        al_stg.report()
+        save_rois(store, al_stg)
+
+    if recording is not None:
+        recording.close()
+        log.info(f"Recorded {recording.count} frames ({recording.stored} stored) to {args.record}")
+
+
+def start_pipeline(source, listener):
+    """
+    start capturing in the background when --pipeline is set, it stops with the listener
+    """
+    if isinstance(source, PipelinedSource):
+        source.start(listener)
+
+
+def stop_pipeline(source):
+    """
+    stop the capture and actor threads and log how many frames and clicks went through them
+    """
+    if isinstance(source, PipelinedSource):
+        source.stop()
+        Button.input.stop()
+        log.info(f"Pipeline capture: {source}, input: {Button.input}")
+
+
+def init_stage(source, store: CalibrationStore, metrics_file: pathlib.PurePath, backend=None,
+               enhance_file: pathlib.PurePath = None) -> Stage:
+    """
+    calibrate the GUI scale on source and locate the back and battle buttons
+    :param backend: input backend of the Stage, defaults to Button.input
+    :param enhance_file: where the maxed ships of this Stage are kept, defaults to --enhance_file
+    """
+    metrics = Metrics(metrics_file)
+    pipelined = isinstance(source, PipelinedSource)
+    back_name = None  # secretary of the stored buttons, checked first when locating them again
+    for attempt in range(2):
+        templates, scale = init_scale(source, store)
+        roi = RoiTracker(ROI_HINTS)
+        matcher = MultiMatcher(templates, scale, workers=args.match_workers if pipelined else 0, roi=roi,
+                               metrics=metrics)
+        # a pipelined grab blocks until the next frame, no need to sleep between polls
+        waiter = Waiter(source, matcher, log, min_poll=0 if pipelined else 0.05)
+
+        coords, entry = load_buttons(store, source, matcher, scale)
+        if entry is not None:
+            back_name = entry["back_name"]
+        if coords is not None or entry is None or attempt == 1:
+            break
+        # stored scale may belong to another GUI scale of the same window size, calibrate it again
+        matcher.close()
+
+    if coords is None:
+        # Initialize Back Button by using location of Secretary Image, all secretaries are matched in parallel
+        sec_names = templates.names(scale, contains="secretary")
+        detector = Waiter(source, MultiMatcher(templates, scale, workers=len(sec_names), roi=roi, metrics=metrics),
+                          log)
+        back_btn = init_btn(sec_names, detector, confidence=0.7, desc="Locating Secretary",
+                            prefer=back_name)
+        detector.matcher.close()
+        # Get Battle Button coords from Main Screen
+        battle_btn = init_btn("battle.png", waiter, desc="Locating Battle Btn")
+        coords = back_btn.get_coords(), battle_btn.get_coords()
+        store.put_buttons(waiter.frame.size, scale, coords[0], back_btn.name, coords[1])
+    back_coords, battle_coords = coords
+
+    ships = sorted(x.name for x in args.ship_path.iterdir() if x.suffix.lower() in IMG_SUFFIXES)
+    enhance = Enhance(ships, state_path=args.enhance_file if enhance_file is None else enhance_file)
+    if args.reset_enhanced:
+        enhance.reset()
+    return Stage(templates, scale, back_coords, battle_coords, log, source=source, matcher=matcher,
+                 waiter=waiter, click_hold=args.click_hold, input_backend=backend, enhance=enhance)
+
+
+def init_scale(source, store: CalibrationStore):
+    """
+    generate the scaled image sets when needed and find the scale that matches the emulator
+    :return: (template cache, scale)
+    """
+    sc = Scaler(args.gui_path, args.ship_path, args.secretary_path, log, source=source, store=store)
+    if args.disk_scale:
+        if not args.test_pybot:
+            sc.down_scale(args.num_gui_gen, scale_percent=args.gui_scale)
+        scale = sc.init_img_path()
+    else:
+        scale = sc.calibrate(min_scale=round(1 - args.num_gui_gen * args.gui_scale, 2))
+
+    assert scale is not None, "Unable to find suitable GUI images for pybot. " \
+                                 "Please edit --num_gui_gen and --gui_scale so that pybot " \
+                                 "is able to identify gui buttons on emulator"
+    sc.pack(scale)
+    return sc.templates, scale
+
+
+def load_buttons(store: CalibrationStore, source, matcher: MultiMatcher, scale: float):
+    """
+    use the back/battle coordinates and ROIs of an earlier run when the stored secretary and battle button are
+    still at their stored place on one fresh frame, otherwise the stored scale and buttons are dropped
+    :return: ((back_coords, battle_coords) or None when nothing valid is stored, stored entry or None)
+    """
+    frame = source.grab()
+    entry = store.get_buttons(frame.size, scale)
+    if entry is None:
+        return None, None
+
+    for name, box in entry["rois"].items():
+        matcher.roi.seed(name, box)
+    stored = {entry["back_name"]: entry["back"], "battle.png": entry["battle"]}
+    for name, box in stored.items():
+        matcher.roi.seed(name, box)
+    matches = matcher.match(frame, {entry["back_name"]: 0.7, "battle.png": 0.8})
+    for name, box in stored.items():
+        match = matches[name]
+        if not match.hit or max(abs(match.left - box[0]), abs(match.top - box[1])) > 4:
+            log.info(f"Stored location of {name} does not match the screen, dropping the stored calibration "
+                     f"of window size {frame.size}")
+            store.drop(frame.size)
+            return None, entry
+    log.info(f"Using stored button locations for window size {frame.size}")
+    return (tuple(entry["back"]), tuple(entry["battle"])), entry
+
+
+def save_rois(store: CalibrationStore, stage: Stage):
+    """
+    keep the template locations learned during the run for the next start
+    """
+    if stage.frame is not None and stage.matcher.roi is not None:
+        store.put_rois(stage.frame.size, stage.scale, stage.matcher.roi.learned())
+
+
+def run_instances(store: CalibrationStore, metrics_file: pathlib.PurePath):
+    """
+    drive one Stage per emulator window in --instances from this process
+    """
+    orchestrator = Orchestrator(SharedCapture(capture_backend(args.capture)), log)
+    backend = input_backend(args.input)
+    for idx, title in enumerate(args.instances):
+        window = Window(title)
+        source = orchestrator.source(window)
+        serial_input = orchestrator.input(backend, source)
+        log.info(f"Instance {title}: window {window.rect()}")
+        if args.test_gui_img:
+            init_scale(source, store)
+            continue
+        enhance_file = args.enhance_file.with_name(f"{args.enhance_file.stem}-{idx}{args.enhance_file.suffix}")
+        stage = init_stage(source, store, metrics_file.with_name(f"{metrics_file.stem}-{idx}{metrics_file.suffix}"),
+                           backend=serial_input, enhance_file=enhance_file)
+        orchestrator.add(Instance(title, stage, source, serial_input))
+
+    if args.test_gui_img:
+        return
+    with start_listener() as listener:
+        orchestrator.run(listener)
+        log.info("Force Ending Process")
+    orchestrator.report()
+    for instance in orchestrator.instances:
+        instance.stage.report()
+        save_rois(store, instance.stage)
+
+
+def start_listener():
+    """
+    keyboard listener that stops pybot on ctrl-l then q
+    """
+    global esc_condition
+    from pynput import keyboard  # needs a display, not imported for replays
+
+    esc_condition = (keyboard.Key.ctrl_l, keyboard.KeyCode(char="q"))
+    log.info("Press Keyboard 'ctrl-l' release then 'q' to Quit ...")
+    return keyboard.Listener(on_press=on_press)
 
 
 def on_press(key):
-    log.info(f"{h.trace()} Pressed {key}")
+    log.info(f"Pressed {key}")
     if key in esc_condition:
         pressed_input.add(key)
         if all(k in pressed_input for k in esc_condition):
             return False
 
 
-def init_btn(img_paths: Union[List[pathlib.PurePath], str, pathlib.PurePath],
-             num_retry=10,
+def start_profiler() -> Profiler:
+    """
+    wrap the hot paths with timers, only done with --profile so a normal run is not slowed down
+    """
+    profiler = Profiler(args.profile)
+    profiler.wrap(Scaler, "down_scale")
+    profiler.wrap(Scaler, "init_img_path")
+    profiler.wrap(Scaler, "calibrate")
+    profiler.wrap(sys.modules[__name__], "init_btn", name="pybot.init_btn")
+    profiler.wrap(Stage, "run")
+    profiler.wrap(Enhance, "run")
+    profiler.wrap(Enhance, "_enhance_process")
+    profiler.wrap(Waiter, "wait_for")
+    profiler.wrap(MultiMatcher, "_match_one", key=lambda matcher, frame, template, *_: template.name)
+    for source in {*CAPTURE_BACKENDS.values(), ReplaySource, PipelinedSource}:
+        profiler.wrap(source, "grab")
+    profiler.start()
+    return profiler
+
+
+def init_btn(img_names: Union[List[str], str],
+             waiter: Waiter,
+             timeout=10,
              confidence=0.8,
-             desc=None) -> Set:
-    img_paths = img_paths if isinstance(img_paths, list) else [Path(img_paths)]
-    pbar = tqdm(enumerate(img_paths), total=len(img_paths), desc=desc)
-    for idx, img_path in pbar:
-        retry = 0
-        while retry < num_retry + 1:
-            back_btn = Button(img_path, confidence=confidence)
-            if back_btn.exist():
-                pbar.update(len(img_paths) - idx)
-                pbar.close()
-
-                log.info(f"{h.trace()} Found Button Location of {img_path.name}.")
-
-                return back_btn.get_coords()
-
-            retry += 1
-            log.debug(f"{h.trace()} Retry ({retry}/{num_retry}) to find {img_path.name}")
-    log.error(f"{h.trace()} Unable to find suitable GUI images for pybot. Please edit --num_gui_gen and --gui_scale "
-              f"so that pybot is able to identify gui buttons on emulator")
+             desc=None,
+             prefer: str = None) -> Button:
+    """
+    wait until one of the templates shows up. Every poll matches all of them against the same frame (in parallel
+    when the matcher has workers) and the best scoring one wins
+    :param timeout: seconds for all templates together
+    :param prefer: template checked alone on the first frame, e.g. the secretary found by the last run
+    :return: Button of the best match, its name tells which template matched
+    """
+    img_names = img_names if isinstance(img_names, list) else [img_names]
+    if desc is not None:
+        log.info(f"{desc} ...")
+
+    match = None
+    if prefer in img_names:
+        match = waiter.wait_for({prefer: confidence}, timeout=0, transition=f"startup -> {prefer}")
+    if match is None:
+        group = {img_name: confidence for img_name in img_names}
+        match = waiter.wait_for(group, timeout=timeout, transition=f"startup -> {'|'.join(img_names)}")
+    if match is not None:
+        log.info(f"Found Button Location of {match.name} ({match.confidence:.3f}).")
+        return Button(match=match)
+
+    log.debug(f"None of {img_names} found after {timeout}s")
+    log.error("Unable to find suitable GUI images for pybot. Please edit --num_gui_gen and --gui_scale "
+              "so that pybot is able to identify gui buttons on emulator")
     sys.exit()
 
 
 if __name__ == '__main__':
-    main()
+    args = parser.parse_args()
+
+    """ Initializing Logging Properties """
+    logs = Log(log_path=args.log_dir,
+               queued=not args.sync_log,
+               max_bytes=int(args.log_rotate_mb * 1024 * 1024),
+               backup_count=args.log_keep)
+    log = logs.get_logger()
+
+    profiler = None if args.profile is None else start_profiler()
+    try:
+        main()
+    finally:
+        if profiler is not None:
+            profiler.stop()
+            profiler.write(args.log_dir / f"profile-{logs.today_datetime}", log)
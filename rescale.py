@@ -1,14 +1,21 @@
-import imghdr
+import hashlib
+import json
 import logging
 import pathlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 from typing import Union, List
-from tqdm import tqdm
 import cv2
 import shutil
 
 import helper as h
-from azurlane.Button import Button
+from azurlane.bank import BANK_FILE, TemplateBank
+from azurlane.calibration import CalibrationStore
+from azurlane.frame import FrameSource, ScreenSource
+from azurlane.scaling import ScaleFinder
+from azurlane.templates import TemplateCache, IMG_SUFFIXES
+
+MANIFEST = "manifest.json"
 
 
 class Scaler:
@@ -17,8 +24,15 @@ class Scaler:
                  ship_path: Union[pathlib.PurePath, str],
                  secretary_path: Union[pathlib.PurePath, str],
                  log: logging,
-                 dst_path: Union[pathlib.PurePath, str] = None):
+                 dst_path: Union[pathlib.PurePath, str] = None,
+                 source: FrameSource = None,
+                 store: CalibrationStore = None):
+        """
+        :param store: persisted scale per window size, calibration is skipped when the stored scale matches the frame
+        """
         self.log = log
+        self.store = store
+        self.source = ScreenSource() if source is None else source
 
         self.secretary_path = Path(secretary_path) if isinstance(secretary_path, str) else secretary_path
         self.src_path = Path(src_path) if isinstance(src_path, str) else src_path
@@ -32,93 +46,181 @@ class Scaler:
         else:
             self.dst_path = Path(dst_path) if isinstance(dst_path, str) else dst_path
 
-    def down_scale(self, num_to_gen, scale_percent=0.1):
+        self.templates = TemplateCache([self.dst_path, self.src_path, self.ship_path, self.secretary_path], log)
+        self.bank_path = self.dst_path / BANK_FILE
+        if self.templates.attach(TemplateBank.open(self.bank_path)):
+            self.log.debug(f"Templates mapped from {self.bank_path}")
+        if store is not None and store.digest is None:
+            store.digest = self.templates.digest()
+        self.finder = ScaleFinder(self.templates, log)
+
+    def down_scale(self, num_to_gen, scale_percent=0.1, workers=None):
         """
-        down scale image sets
+        down scale image sets. Only images that are new or changed since the last run (content hash kept in
+        manifest.json), or whose scaled copies are missing, are regenerated, each one decoded once and resized to
+        every scale in a process pool.
         :param num_to_gen: number of sets to generate
         :param scale_percent: down scale percentage
+        :param workers: number of processes, defaults to cpu count
         """
-        assert (num_to_gen * scale_percent) <= 0.99, f"Please change num_to_gen or scale_percent. " \
+        assert (num_to_gen * scale_percent) <= 0.99, "Please change num_to_gen or scale_percent. " \
                                                      f"Incompatible combination. Check: {scale_percent * num_to_gen}"
-        scale = 1 - scale_percent
-
-        paths = self._get_img_paths()
-        for i in tqdm(range(num_to_gen), total=num_to_gen, desc="Down Scaling GUI"):
-            for img_path in paths:
-                if imghdr.what(str(img_path)) is None:
-                    continue
-
-                scale = round(scale, 2)
-
-                # scale down images
-                img = cv2.imread(str(img_path), 1)
-                scaled_img = cv2.resize(img, (0, 0), fx=scale, fy=scale)
-
-                # create folder to store images
-                dst = self.dst_path / f"{str(scale).replace('.', '_')}"
-                dst.mkdir(parents=True, exist_ok=True)
-
-                cv2.imwrite(str(dst / img_path.name), scaled_img)
-
-            scale -= scale_percent
-
-        # create a folder for original images
-        ori_dst = self.dst_path / "1_0"
-        ori_dst.mkdir(parents=True, exist_ok=True)
-        for image_path in paths:
-            if imghdr.what(image_path) is None:
-                continue
-
-            shutil.copy(image_path, ori_dst / image_path.name)
-
-    def init_img_path(self):
+        scales = [round(1 - scale_percent * (i + 1), 2) for i in range(num_to_gen)]
+
+        manifest_path = self.dst_path / MANIFEST
+        manifest = json.loads(manifest_path.read_text()) if manifest_path.is_file() else {}
+        if manifest.get("scales") != scales:
+            manifest = {"scales": scales, "images": {}}  # scale sets changed, everything has to be regenerated
+
+        paths = [x for x in self._get_img_paths() if x.suffix.lower() in IMG_SUFFIXES]
+        hashes = {str(x): hashlib.sha1(x.read_bytes()).hexdigest() for x in paths}
+        # a scale folder or copy deleted by hand is regenerated even though the image did not change
+        outputs = [self.dst_path / self._scale_dir(scale) for scale in scales + [1.0]]
+        todo = [x for x in paths if manifest["images"].get(str(x)) != hashes[str(x)] or
+                not all((folder / x.name).is_file() for folder in outputs)]
+
+        # drop scaled copies of images that no longer exist
+        for removed in set(manifest["images"]) - set(hashes):
+            for scale in scales + [1.0]:
+                (self.dst_path / self._scale_dir(scale) / Path(removed).name).unlink(missing_ok=True)
+            del manifest["images"][removed]
+
+        if len(todo) == 0:
+            self.log.info("GUI image sets are up to date")
+            return
+
+        # only needed when image sets are generated, kept out of the startup of every other run
+        from concurrent.futures import ProcessPoolExecutor
+        from tqdm import tqdm
+
+        self.log.info(f"Down Scaling {len(todo)}/{len(paths)} images to {len(scales)} scales")
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(_scale_image, img_path, self.dst_path, scales): img_path for img_path in todo}
+            for future in tqdm(as_completed(futures), total=len(futures), desc="Down Scaling GUI"):
+                img_path = futures[future]
+                if future.result():
+                    manifest["images"][str(img_path)] = hashes[str(img_path)]
+                else:
+                    self.log.warning(f"Unable to read {img_path}, skipped")
+
+        manifest_path.write_text(json.dumps(manifest, indent=2))
+
+    def pack(self, scale: float = None):
         """
-        compare scaled images/ original with BlueStack GUI and find which scaled image best fit
-        GUI
-        :return: selected image set path
+        pack every template of the image sets on disk, and of scale, into the template bank when it is missing
+        or stale. Later runs, and other pybot processes, map it instead of decoding images.
+        :param scale: scale found by calibrate/init_img_path
         """
-        # get list of image names
-        img_names = []
-        for folder in self.dst_path.iterdir():
-            if folder.is_dir():
-                for file in folder.iterdir():
-                    if file.is_dir():
-                        continue
-                    img_names.append(file.name)
-                break
-
-        self.log.info(f"{h.trace()} List of Scaled Images: {img_names}")
-        # check with all scaled image
-        gone_through = []
-        with tqdm(img_names, total=len(img_names), desc="Finding GUI Image Set") as pbar:
-            for img_name in pbar:
-                paths = self._sort_paths([x for x in self.dst_path.iterdir() if x.is_dir()])
-
-                for scale_path in paths:
-                    if not scale_path.is_dir():
-                        continue
-
-                    img_path = scale_path / img_name
-                    btn = Button(img_path)
-                    if btn.exist():
-                        pbar.update(len(img_names) - len(gone_through))
-                        pbar.close()
-                        self.log.info(f"{h.trace()} Found Match: {img_path}")
-                        return scale_path
-
-                gone_through.append(img_name)
+        scales = self.templates.scales() + ([] if scale is None else [round(scale, 2)])
+        bank = self.templates.bank
+        if bank is not None and bank.fresh(self.templates.paths) and \
+                all(bank.has(name, x) for x in scales for name in self.templates.names(x)):
+            return
+
+        start = h.timer()
+        self.templates.detach()  # the bank this process maps has to be closed before it is replaced
+        try:
+            count = TemplateBank.build(self.bank_path, self.templates, scales)
+        except OSError as e:  # e.g. Windows does not replace a bank that another pybot process still maps
+            self.log.warning(f"Unable to write template bank {self.bank_path}: {e}")
+            self.templates.attach(TemplateBank.open(self.bank_path))
+            return
+        self.templates.attach(TemplateBank.open(self.bank_path))
+        self.log.info(f"Packed {count} templates of scales {sorted(set(scales))} into {self.bank_path} "
+                      f"in {h.timer(start)}s")
 
     @staticmethod
-    def _sort_paths(path_list):
-        data = {}
-        for x in path_list:
-            data.update({float(x.name.replace("_", ".")): x})
-
-        ret_list = []
-        for x in sorted(data.keys(), reverse=True):
-            ret_list.append(data[x])
+    def _scale_dir(scale: float) -> str:
+        return f"{str(round(scale, 2)).replace('.', '_')}"
 
-        return ret_list
+    def calibrate(self, names: List[str] = None, min_scale: float = 0.25, confidence: float = 0.8):
+        """
+        find the GUI scale in memory from a single frame, no scaled image sets are needed on disk
+        :param names: reference templates visible on screen, defaults to battle button and secretaries (main menu)
+        :param min_scale: smallest scale searched
+        :param confidence: minimum confidence of the best reference template
+        :return: selected scale, None if nothing matched
+        """
+        if names is None:
+            names = ["battle.png"] + self.templates.names(contains="secretary")
+        self.finder.min_scale = min_scale
+
+        frame = self.source.grab()
+        cached = self._stored_scale(frame, "memory", names, confidence)
+        if cached is not None:
+            return cached
+
+        start = h.timer()
+        scale, score = self.finder.find(frame, names, confidence=confidence)
+        self.log.info(f"Calibrated scale {scale} (confidence {score:.3f}) in {h.timer(start)}s")
+        if scale is not None and self.store is not None:
+            self.store.put(frame.size, "memory", scale, score)
+        return scale
+
+    def init_img_path(self, names: List[str] = None, confidence: float = 0.8, workers: int = 4, stride: int = 3):
+        """
+        compare scaled images/ original with BlueStack GUI and find which scaled image best fit
+        GUI. One frame is captured and the reference templates of the scale sets are scored against its half size
+        pyramid level in a thread pool: every 'stride'-th scale first, then the neighbours of the best one.
+        The winner is confirmed at full resolution.
+        :param names: reference templates visible on screen, defaults to battle button and secretaries (main menu)
+        :param confidence: minimum confidence of the best scale
+        :param workers: threads used to score scales
+        :param stride: distance between scales scored in the first pass, 1 scores every scale
+        :return: selected image set scale
+        """
+        self.templates.reload()  # pick up image sets written by down_scale
+        if names is None:
+            names = ["battle.png"] + self.templates.names(contains="secretary")
+        scales = self.templates.scales()
+
+        # screen does not change while calibrating, match every scaled image against one frame
+        frame = self.source.grab()
+        cached = self._stored_scale(frame, "disk", names, confidence)
+        if cached in scales:
+            return cached
+
+        self.log.info(f"Scoring {names} over scales {scales}")
+        start = h.timer()
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            def score(candidates):
+                return dict(zip(candidates, pool.map(lambda x: self._score_scale(frame, names, x), candidates)))
+
+            scores = score(scales[::stride])
+            peak = scales.index(max(scores, key=scores.get))
+            neighbours = [x for x in scales[max(peak - stride + 1, 0):peak + stride] if x not in scores]
+            scores.update(score(neighbours))
+
+        best = max(scores, key=scores.get)
+        score = self._score_scale(frame, names, best, level=0)
+        self.log.info(f"Best scale {best} (confidence {score:.3f}) after scoring "
+                      f"{len(scores)}/{len(scales)} scales in {h.timer(start)}s")
+        if score < confidence:
+            return None
+
+        if self.store is not None:
+            self.store.put(frame.size, "disk", best, score)
+        return best
+
+    def _stored_scale(self, frame, mode: str, names: List[str], confidence: float):
+        """
+        scale stored for the frame size. Without a window the frame size is the desktop size and says nothing
+        about the emulator, the stored scale is then scored on the frame first
+        :return: stored scale, None when nothing is stored or it does not match the frame
+        """
+        scale = None if self.store is None else self.store.get(frame.size, mode)
+        if scale is None:
+            return None
+        if self.source.window is None:
+            score = self._score_scale(frame, names, scale, level=0)
+            if score < confidence:
+                self.log.info(f"Stored scale {scale} scores {score:.3f} on the frame, calibrating again")
+                return None
+        self.log.info(f"Using stored scale {scale} for window size {frame.size}")
+        return scale
+
+    def _score_scale(self, frame, names, scale, level=1) -> float:
+        return max(self.templates.get(name, scale).level(level).match(frame.pyramid(level))[0] for name in names)
 
     def _get_img_paths(self) -> List[pathlib.PurePath]:
         gui_paths = [x for x in self.src_path.iterdir() if x.is_file()]
@@ -126,3 +228,24 @@ class Scaler:
         sec_paths = [x for x in self.secretary_path.iterdir()]
         paths = gui_paths + enhance_paths + sec_paths
         return paths
+
+
+def _scale_image(img_path: pathlib.PurePath, dst_path: pathlib.PurePath, scales: List[float]) -> bool:
+    """
+    decode one image and write it resized to every scale, plus the original into '1_0'. Runs in a worker process
+    :return: False when the image could not be decoded
+    """
+    img = cv2.imread(str(img_path), cv2.IMREAD_COLOR)
+    if img is None:
+        return False
+
+    for scale in scales:
+        dst = dst_path / Scaler._scale_dir(scale)
+        dst.mkdir(parents=True, exist_ok=True)
+        cv2.imwrite(str(dst / img_path.name), cv2.resize(img, (0, 0), fx=scale, fy=scale))
+
+    # create a folder for original images
+    ori_dst = dst_path / Scaler._scale_dir(1.0)
+    ori_dst.mkdir(parents=True, exist_ok=True)
+    shutil.copy(img_path, ori_dst / img_path.name)
+    return True
@@ -0,0 +1,6 @@
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+# pybot is run from the repository root, its modules import each other from there
+sys.path.insert(0, str(ROOT))
@@ -0,0 +1,40 @@
+"""
+Change detection of the matcher on a large desktop capture.
+"""
+import logging
+from pathlib import Path
+
+import numpy as np
+
+from azurlane.frame import Frame
+from azurlane.matcher import MultiMatcher, changed
+from azurlane.templates import TemplateCache
+
+ROOT = Path(__file__).resolve().parents[1]
+log = logging.getLogger("test_matcher")
+
+
+def test_small_button_on_desktop_is_not_reused_as_miss():
+    templates = TemplateCache([ROOT / "azurlane" / "GUI"], log, reload_interval=0)
+    template = templates.get("ttc.png", 0.5)
+    height, width = template.shape
+    empty = np.full((1080, 1920, 3), 120, np.uint8)
+    shown = empty.copy()
+    # faint button, averaged away by a whole frame signature but still found by the normalized correlation
+    button = 120 + (template.gray.astype(np.float32) - template.gray.mean()) * 0.2
+    shown[500:500 + height, 900:900 + width] = np.clip(button, 0, 255).astype(np.uint8)[..., None]
+    assert not changed(Frame(empty).signature(), Frame(shown).signature(), 4)
+
+    matcher = MultiMatcher(templates, 0.5)
+    assert not matcher.match(Frame(empty), {"ttc.png": 0.8})["ttc.png"].hit
+    match = matcher.match(Frame(shown), {"ttc.png": 0.8})["ttc.png"]
+    assert match.hit and (match.left, match.top) == (900, 500)
+
+
+def test_static_result_is_searched_again_after_max_age():
+    templates = TemplateCache([ROOT / "azurlane" / "GUI"], log, reload_interval=0)
+    frame = Frame(np.full((360, 640, 3), 120, np.uint8))
+    matcher = MultiMatcher(templates, 0.5, static_max_age=0)
+    matcher.match(frame, {"ttc.png": 0.8})
+    matcher.match(frame, {"ttc.png": 0.8})
+    assert matcher.skipped == 0
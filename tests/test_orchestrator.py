@@ -0,0 +1,50 @@
+"""
+Shared capture of several instances, with a fake desktop and mouse
+"""
+import threading
+import time
+
+import numpy as np
+
+from azurlane.capture import MssSource
+from azurlane.frame import FrameSource
+from azurlane.inputs import FakeInput
+from azurlane.orchestrator import SharedCapture, RegionSource, SerialInput
+from azurlane.window import Window
+
+
+class DesktopSource(FrameSource):
+    def grab(self):
+        return self._new_frame(np.zeros((200, 400, 3), dtype=np.uint8), time.perf_counter())
+
+
+class FakeSct:
+    monitors = [{"left": 0, "top": 0, "width": 400, "height": 100},
+                {"left": 0, "top": 0, "width": 200, "height": 100},
+                {"left": 200, "top": 0, "width": 200, "height": 100}]
+
+
+def test_instance_gets_no_capture_from_before_its_click():
+    capture = SharedCapture(DesktopSource(), max_age=60)
+    lock = threading.Lock()
+    first = RegionSource(capture, Window(rect=(0, 0, 100, 100)))
+    second = RegionSource(capture, Window(rect=(200, 0, 100, 100)))
+    mouse = SerialInput(FakeInput(), first, lock)
+
+    first.grab()
+    second.grab()
+    assert capture.source.count == 1  # second instance shares the capture
+    mouse.click(10, 10, hold=0)
+    first.grab()
+    assert capture.source.count == 2  # captured again, the shared one was taken before the click
+    second.grab()
+    assert capture.source.count == 2  # second instance did not click, the new capture is shared
+    assert mouse.backend.clicks[0][:2] == (10, 10)
+
+
+def test_mss_region_monitor():
+    source = MssSource()
+    source.local.sct = FakeSct()
+    assert source.monitor_for((10, 10, 100, 50)) == 1
+    assert source.monitor_for((250, 0, 100, 100)) == 2
+    assert source.monitor_for((150, 0, 100, 100)) == 0  # spans both monitors
@@ -0,0 +1,92 @@
+"""
+Replay recorded farming sessions headless, no emulator, display or input device is needed.
+"""
+import logging
+from pathlib import Path
+
+import pytest
+
+import pybot
+from azurlane.Button import Button
+from azurlane.al_stage import Stage, ROI_HINTS
+from azurlane.inputs import FakeInput
+from azurlane.matcher import MultiMatcher
+from azurlane.replay import ReplaySource
+from azurlane.roi import RoiTracker
+from azurlane.templates import TemplateCache
+from azurlane.wait import Waiter
+from benchmark import synthetic_archive
+from rescale import Scaler
+
+ROOT = Path(__file__).resolve().parents[1]
+GUI_PATH, SHIP_PATH, SECRETARY_PATH = ROOT / "azurlane" / "GUI", ROOT / "ships_to_enhance", ROOT / "secretaries"
+LOOPS = 2
+log = logging.getLogger("test_replay")
+
+
+@pytest.fixture(scope="module")
+def templates():
+    return TemplateCache([GUI_PATH, SHIP_PATH, SECRETARY_PATH], log, reload_interval=0)
+
+
+@pytest.fixture(scope="module", params=[1.0, 0.8])
+def archive(request, templates, tmp_path_factory):
+    """
+    :return: (archive path, scale it was recorded at, {name: (top, left)} of the templates on its frames)
+    """
+    path = tmp_path_factory.mktemp("replay") / "synthetic.zip"
+    positions = synthetic_archive(templates, path, request.param, loops=LOOPS)
+    return path, request.param, positions
+
+
+@pytest.fixture
+def fake_input(monkeypatch):
+    def install(source):
+        backend = FakeInput(source)
+        monkeypatch.setattr(Button, "input", backend)
+        return backend
+
+    return install
+
+
+def test_matcher_hits_recorded_buttons(archive, templates):
+    path, scale, positions = archive
+    frame = ReplaySource(path).grab()
+    matches = MultiMatcher(templates, scale).match(frame, {"secretary1.png": 0.7, "battle.png": 0.8, "go.png": 0.8})
+
+    for name in ("secretary1.png", "battle.png"):
+        assert matches[name].hit, f"{name} not found ({matches[name].confidence:.3f})"
+        assert (matches[name].top, matches[name].left) == positions[name]
+    assert not matches["go.png"].hit
+
+
+def test_calibrate_finds_recorded_scale(archive):
+    path, scale, _ = archive
+    scaler = Scaler(GUI_PATH, SHIP_PATH, SECRETARY_PATH, log, source=ReplaySource(path))
+    assert scaler.calibrate() == scale
+
+
+def test_stage_replays_every_loop(archive, templates, fake_input):
+    path, scale, positions = archive
+    source = ReplaySource(path)
+    clicks = fake_input(source).clicks
+    matcher = MultiMatcher(templates, scale, roi=RoiTracker(ROI_HINTS))
+    waiter = Waiter(source, matcher, log)
+
+    back_btn = pybot.init_btn(templates.names(scale, contains="secretary"), waiter, confidence=0.7)
+    battle_btn = pybot.init_btn("battle.png", waiter)
+    assert back_btn.name == "secretary1.png"
+    stage = Stage(templates, scale, back_btn.get_coords(), battle_btn.get_coords(), log, source=source,
+                  matcher=matcher, waiter=waiter, click_hold=0)
+    while source.running:
+        stage.run(source)
+
+    def clicked(x, y):
+        for name, (top, left) in positions.items():
+            height, width = templates.get(name, scale).shape
+            if left <= x < left + width and top <= y < top + height:
+                return name
+
+    expected = ["battle.png"] + ["stage_12.png", "go.png", "continue.png"] * LOOPS
+    assert [clicked(x, y) for x, y, _ in clicks] == expected
+    assert stage.loops == LOOPS